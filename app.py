@@ -1,16 +1,46 @@
-from flask import Flask, flash, request, redirect, render_template, url_for
+from flask import Flask, flash, request, redirect, render_template, url_for, jsonify, g, Response
 from werkzeug.utils import secure_filename
 from config import Config
-import pandas as pd
 import datarobot as dr
 import roi   # Import the file: roi.py
 import opti  # Optimise over 
+import cache # Cached DataRobot lookups
+import datasets
+import scoring
+import jobs
+import metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import json
+import time
+import uuid
 import os
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config.from_object(Config)
 
 
+# ###################################################################################
+# Per-route latency and request counts
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    if 'start_time' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        seconds = time.perf_counter() - g.start_time
+        metrics.route_seconds.observe(seconds, route=route, method=request.method)
+        metrics.route_requests.inc(route=route, method=request.method, status=response.status_code)
+        metrics.timing(metrics.route_seconds, seconds, route=route, method=request.method,
+                       status=response.status_code)
+    return response
+
+
 ALLOWED_EXTENSIONS = set(['csv', 'tsv'])
 def allowed_file(filename):
     return '.' in filename and \
@@ -21,9 +51,25 @@ def allowed_file(filename):
 # Index Page
 @app.route('/')
 def index():
-    # GET THE LIST OF PROJECTS
-    projs = dr.Project.list()
-    return render_template("index.html", projects=projs)
+    # ONE PAGE OF THE (CACHED) LIST OF PROJECTS, OPTIONALLY FILTERED BY NAME
+    search = request.args.get("q", "")
+    page, per_page = page_args(app.config['PROJECTS_PER_PAGE'])
+    projs, more = cache.search_projects(search, page, per_page)
+    return render_template("index.html", projects=projs, search=search, page=page, more=more)
+
+
+# ###################################################################################
+# Paging arguments: a missing or malformed value falls back to the default, and
+# per_page is kept between 1 and PROJECTS_MAX_PER_PAGE.
+def page_args(default_per_page):
+    def number(name, default):
+        try:
+            return int(request.args.get(name) or default)
+        except ValueError:
+            return default
+    page = max(1, number("page", 1))
+    per_page = min(max(1, number("per_page", default_per_page)), app.config['PROJECTS_MAX_PER_PAGE'])
+    return page, per_page
 
 
 # ###################################################################################
@@ -33,51 +79,87 @@ def index():
 def approach():
     if request.method == 'POST':
        projectId = request.form["projectId"]
-    proj = dr.Project.get(project_id=projectId)
+    proj = cache.get_project(projectId)
     proj_type = proj.target_type
-    mods = proj.get_models()
+    mods = cache.get_models(proj)
 
     if proj_type == 'Binary':
        return render_template("binary.html", project=proj, models=mods)
     if proj_type == 'Regression':
        return render_template("regression.html", project=proj, models=mods)
    
-    projs = dr.Project.list()
+    projs, more = cache.search_projects(page=1, per_page=app.config['PROJECTS_PER_PAGE'])
     return render_template("unsupported.html", project=proj, models=mods, projects=projs)
 
+# ###################################################################################
+# Regression analyses read their parameters from the form (or query string) with
+# defaults, so the first visit from the project page shows an example analysis.
+def regression_params(defaults):
+    params = {}
+    for name, default in defaults.items():
+        params[name] = type(default)(request.values[name]) if name in request.values else default
+    return params
+
+def regression_analysis(template, analysis, defaults):
+    projectId = request.values.get("projectId")
+    if projectId == None:
+       return render_template("error.html")
+    params = regression_params(defaults)
+    num_models = params.pop("num_models")
+    proj = cache.get_project(projectId)
+    mods = cache.get_models(proj)
+    message = None
+    if not cache.actuals_available(proj):
+       message = ("This project was created from an uploaded file, so its actuals cannot be read and the costs "
+                  "are estimated from the residuals chart, a random sample of at most 1000 validation rows.")
+    modcost = roi.evalRegressionModels(project=proj, models=mods, num_models=num_models, analysis=analysis,
+                                       max_workers=app.config['ROC_FETCH_WORKERS'],
+                                       timeout=app.config['ROC_FETCH_TIMEOUT'], **params)
+    return render_template(template, project=proj, models=modcost, num_models=num_models, message=message,
+                           **params)
+
 # ###################################################################################
 # Discrete Boundary between useful and costly predictions 
 @app.route('/regression_discrete', methods = ['POST', 'GET'])
 def regression_discrete():
-    return render_template("not_implemented_yet.html")
+    return regression_analysis("regression_discrete.html", roi.discreteErrorCost,
+                               dict(num_models=1, cases=1000.0, over_pct=10.0, over_cost=100.0,
+                                    under_pct=5.0, under_cost=200.0))
 
 # ###################################################################################
 # Continuous relatiponsip between error and costs 
 @app.route('/regression_continuous', methods = ['POST', 'GET'])
 def regression_continuous():
-    return render_template("not_implemented_yet.html")
+    return regression_analysis("regression_continuous.html", roi.continuousErrorCost,
+                               dict(num_models=1, cases=1000.0, tolerance_pct=10.0, cost_per_pct=100.0))
 
 # ###################################################################################
 # Costs are proportional to Aggregated Error
 @app.route('/regression_aggregate', methods = ['POST', 'GET'])
 def regression_aggregate():
-    return render_template("not_implemented_yet.html")
+    return regression_analysis("regression_aggregate.html", roi.aggregateErrorCost,
+                               dict(num_models=1, group_size=100, unit_pct=10.0, cost_per_unit=1000.0,
+                                    num_groups=52))
 
 
 # ###################################################################################
 # Cost/Benefit Payoff Analysis For Binary Classification
 @app.route('/costbenefit', methods = ['POST', 'GET'])
 def costbenefit():
+    draws = 0
+    exact = False
     if request.method == 'POST':
        projectId = request.form["projectId"]
        if 'tp' in request.values:
-          tp = float(request.form["tp"])
-          fp = float(request.form["fp"])
-          tn = float(request.form["tn"])
-          fn = float(request.form["fn"])
-          cases = float(request.form["cases"])
-          baserate = float(request.form["baserate"])
+          tp = payoff_value(request.form["tp"])
+          fp = payoff_value(request.form["fp"])
+          tn = payoff_value(request.form["tn"])
+          fn = payoff_value(request.form["fn"])
+          cases = payoff_value(request.form["cases"])
+          baserate = payoff_value(request.form["baserate"])
           num_models = int(request.form["num_models"])
+          draws = int(request.form.get("draws") or 0)
+          exact = request.form.get("thresholds") == "exact"
        else:
           num_models = 1
           tp = 1000
@@ -92,17 +174,98 @@ def costbenefit():
     if projectId == None:
        return render_template("error.html")
     else:
-       proj = dr.Project.get(project_id=projectId)
-       mods = proj.get_models()
+       proj = cache.get_project(projectId)
+       mods = cache.get_models(proj)
+       exact, message = exact_mode(proj, exact)
        modroi = roi.evalBinaryClassModels(project=proj, models=mods, num_models=num_models, 
-                                         tp=tp, fp=fp, tn=tn, fn=fn, cases=cases, baserate=baserate)
+                                         tp=roi.centralValue(tp), fp=roi.centralValue(fp),
+                                         tn=roi.centralValue(tn), fn=roi.centralValue(fn),
+                                         cases=roi.centralValue(cases), baserate=roi.centralValue(baserate),
+                                         max_workers=app.config['ROC_FETCH_WORKERS'],
+                                         timeout=app.config['ROC_FETCH_TIMEOUT'], exact=exact)
+       if draws > 0:
+          simulated = roi.simulateBinaryClassModels(mods, num_models, draws, app.config['SIMULATION_SEED'],
+                                                    tp=tp, fp=fp, tn=tn, fn=fn, cases=cases, baserate=baserate,
+                                                    max_workers=app.config['ROC_FETCH_WORKERS'],
+                                                    timeout=app.config['ROC_FETCH_TIMEOUT'], exact=exact)
+          for result in modroi:
+             result.update(simulated.get(result['index'], {}))
 
        return render_template("costbenefit.html", 
                                project=proj, 
-                               models=modroi, num_models=num_models,
+                               models=modroi, num_models=num_models, draws=draws, exact=exact, message=message,
                                tp=tp, fp=fp, tn=tn, fn=fn, cases=cases, baserate=baserate)
 
 
+# ########################################################################################
+# Capacity Constrained Targeting for Binary Classification
+# The ROI each model can deliver when only a fixed number of cases can be contacted,
+# the contacts needed to reach a target ROI, and the ROI across contact volumes.
+@app.route('/capacity', methods = ['POST', 'GET'])
+def capacity():
+    if request.method == 'POST':
+       projectId = request.form["projectId"]
+    else:
+       projectId = request.args.get("projectId")
+
+    if 'capacities' in request.values:
+       num_models = int(request.form["num_models"])
+       tp = float(request.form["tp"])
+       fp = float(request.form["fp"])
+       tn = float(request.form["tn"])
+       fn = float(request.form["fn"])
+       cases = float(request.form["cases"])
+       baserate = float(request.form["baserate"])
+       capacities = request.form["capacities"]
+       target_roi = float(request.form["target_roi"])
+    else:
+       num_models = 1
+       tp = 1000
+       fp = -200
+       tn = 0
+       fn = 0
+       cases = 100000
+       baserate = 0.01
+       capacities = "1000, 5000, 10000"
+       target_roi = 100000
+
+    if projectId == None:
+       return render_template("error.html")
+    proj = cache.get_project(projectId)
+    mods = cache.get_models(proj)
+    limits = [float(c) for c in capacities.split(",") if c.strip() != ""]
+    modcap, volumes = roi.evalCapacityModels(project=proj, models=mods, num_models=num_models,
+                                             capacities=limits, target_roi=target_roi,
+                                             tp=tp, fp=fp, tn=tn, fn=fn, cases=cases, baserate=baserate,
+                                             max_workers=app.config['ROC_FETCH_WORKERS'],
+                                             timeout=app.config['ROC_FETCH_TIMEOUT'])
+    return render_template("capacity.html",
+                           project=proj,
+                           models=modcap, num_models=num_models, volumes=volumes, limits=limits,
+                           tp=tp, fp=fp, tn=tn, fn=fn, cases=cases, baserate=baserate,
+                           capacities=capacities, target_roi=target_roi)
+
+
+# ########################################################################################
+# Exact thresholds read the actuals from the project's training data in the AI Catalog.
+# Projects created from an uploaded file have none, so we say so and use the ROC points.
+def exact_mode(proj, exact):
+    if exact and not cache.actuals_available(proj):
+       return False, ("Exact thresholds need the project's training data in the AI Catalog to read the "
+                      "actuals. This project was created from an uploaded file, so ROC curve points are used.")
+    return exact, None
+
+
+# ########################################################################################
+# A payoff input is either a number or a distribution (see roi.parseDistribution),
+# which is kept as the text the user entered so the form can show it again.
+def payoff_value(text):
+    kind, a, b = roi.parseDistribution(text)
+    if kind == 'fixed':
+       return a
+    return text.strip()
+
+
 # ########################################################################################
 # Intervention Style Analysis for Binary Classification
 @app.route('/intervention', methods = ['POST', 'GET'])
@@ -112,15 +275,19 @@ def intervention():
     else:
        projectId = request.args.get("projectId")
 
+    draws = 0
+    exact = False
     if 'payoff' in request.values:
        num_models=int(request.form["num_models"])
-       cases = float(request.form["cases"])
-       cost = float(request.form["cost"])
-       baserate = float(request.form["baserate"])
-       succrate = float(request.form["succrate"])
-       backfire = float(request.form["backfire"])
-       payoff = float(request.form["payoff"])
-       payback = float(request.form["payback"])
+       cases = payoff_value(request.form["cases"])
+       cost = payoff_value(request.form["cost"])
+       baserate = payoff_value(request.form["baserate"])
+       succrate = payoff_value(request.form["succrate"])
+       backfire = payoff_value(request.form["backfire"])
+       payoff = payoff_value(request.form["payoff"])
+       payback = payoff_value(request.form["payback"])
+       draws = int(request.form.get("draws") or 0)
+       exact = request.form.get("thresholds") == "exact"
     else:
        cases = 1000
        cost  = 10
@@ -130,22 +297,36 @@ def intervention():
        payoff = 1000
        payback = -400
        num_models=1
-    print(cases)
 
     if projectId == None:
        return render_template("error.html")
     else:
-       proj = dr.Project.get(project_id=projectId)
-       mods = proj.get_models()
-       tp, fp, tn, fn = roi.convertIntervention(cases=cases, baserate=baserate, 
-                                                cost=cost, payoff=payoff, payback=payback, 
-                                                succrate=succrate, backfire=backfire)
+       proj = cache.get_project(projectId)
+       mods = cache.get_models(proj)
+       exact, message = exact_mode(proj, exact)
+       tp, fp, tn, fn = roi.convertIntervention(cases=roi.centralValue(cases), baserate=roi.centralValue(baserate), 
+                                                cost=roi.centralValue(cost), payoff=roi.centralValue(payoff),
+                                                payback=roi.centralValue(payback), 
+                                                succrate=roi.centralValue(succrate),
+                                                backfire=roi.centralValue(backfire))
        modroi = roi.evalBinaryClassModels(project=proj, models=mods, num_models=num_models,
-                                         tp=tp, fp=fp, tn=tn, fn=fn, cases=cases, baserate=baserate)
+                                         tp=tp, fp=fp, tn=tn, fn=fn, cases=roi.centralValue(cases),
+                                         baserate=roi.centralValue(baserate),
+                                         max_workers=app.config['ROC_FETCH_WORKERS'],
+                                         timeout=app.config['ROC_FETCH_TIMEOUT'], exact=exact)
+       if draws > 0:
+          simulated = roi.simulateInterventionModels(mods, num_models, draws, app.config['SIMULATION_SEED'],
+                                                     cases=cases, baserate=baserate, cost=cost,
+                                                     payoff=payoff, payback=payback,
+                                                     succrate=succrate, backfire=backfire,
+                                                     max_workers=app.config['ROC_FETCH_WORKERS'],
+                                                     timeout=app.config['ROC_FETCH_TIMEOUT'], exact=exact)
+          for result in modroi:
+             result.update(simulated.get(result['index'], {}))
 
        return render_template("intervention.html",
                                project=proj,
-                               models=modroi, num_models=num_models,
+                               models=modroi, num_models=num_models, draws=draws, exact=exact, message=message,
                                cases=cases, baserate=baserate, cost=cost, payoff=payoff, payback=payback,
                                succrate=succrate, backfire=backfire)
 
@@ -161,12 +342,13 @@ def optimization():
     if projectId == None:
        return render_template("error.html")
     else:
-       proj = dr.Project.get(project_id=projectId)
-       mods = proj.get_models()
+       proj = cache.get_project(projectId)
+       mods = cache.get_models(proj)
        mod = mods[0]
        featurelist_id = mod.featurelist_id
-       feats = mod.get_features_used()
-       fList = dr.Featurelist.get(projectId, featurelist_id)
+       feats = cache.get_features_used(mod)
+       with metrics.remote_call('Featurelist.get'):
+           fList = dr.Featurelist.get(projectId, featurelist_id)
        features = fList.features
        return render_template("optimization.html", project=proj, models=mods, mod=mod, features=feats)
 
@@ -174,51 +356,281 @@ def optimization():
 
 # ########################################################################################
 # Run the Optimization for Binary Classification
+# The optimization runs as a background job: we save the upload, submit the job and
+# send the browser to a status page that polls until the results are ready.
 @app.route('/runoptimization', methods = ['POST', 'GET'])
 def runoptimization():
-    print("/runoptimization :", request.method)
+    log.info("/runoptimization : %s", request.method)
 
     if request.method == 'POST':
         projectId = request.form["projectId"]
-        modelId = request.form["modelId"]
-        colOne = request.form["colone"]
-        colTwo = request.form["coltwo"]
-
-        proj = dr.Project.get(project_id=projectId)
-        mods = proj.get_models()
-        mod = dr.Model.get(projectId, modelId)
-        feats = mod.get_features_used()
+        modelIds = request.form.getlist("modelId")
+        colOne = request.form.get("colone")
+        colTwo = request.form.get("coltwo")
+        mode = request.form.get("mode", "brute_force")
+        columns = request.form.getlist("columns")
+        if len(modelIds) == 0:
+            return render_template("error.html", message="Select at least one model")
+        if mode != "brute_force" and len(modelIds) > 1:
+            return render_template("error.html", message="Only the brute force search can compare several models")
+        if mode == "adaptive" and len(columns) == 0:
+            return render_template("error.html", message="Select at least one column to optimise")
+        modelId = modelIds[0]
 
         # check if the post request has the file part
         if 'file' not in request.files:
             message = 'No file supplied'
-            print("Message: ", message)
+            log.warning("Message: %s", message)
+            return render_template("error.html")
         file = request.files['file']
         # if user does not select file, browser also
         # submit an empty part without filename
         if file.filename == '':
             message = 'empty filname'
-            print("Message: ", message)
-        nrows = 0
-        ncols = 0
+            log.warning("Message: %s", message)
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
+            filename = "%s_%s" % (uuid.uuid4().hex, secure_filename(file.filename))
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
-            pdata = pd.read_csv(filepath)
-            nrows =  len(pdata)
-            ncols = len(pdata.columns)
-
-            total, optimised_lb, optimised_ub, f1c, f2c = opti.run_brute_force(proj, mod, pdata, colOne, colTwo)
 
-            return render_template("runoptimization.html", project=proj, 
-                                    models=mods, model=mod, total=total, features=feats, 
-                                    optimised_lb=optimised_lb, optimised_ub=optimised_ub,
-                                    colone=colOne, coltwo=colTwo,
-                                    feat1_change=f1c, feat2_change=f2c)
+            # HASHING IS A STREAMED READ, SO IT IS DONE HERE TO KEY THE JOB; THE JOB CONVERTS THE UPLOAD (SEE
+            # store_upload), SO A LARGE FILE DOES NOT HOLD UP THE REQUEST
+            digest = datasets.file_digest(filepath)
+            if mode == "brute_force" and len(modelIds) > 1:
+                key = "|".join([digest, projectId, "compare", colOne, colTwo] + modelIds)
+                job = jobs.runner.submit(key, run_comparison_job, projectId, modelIds, filepath, digest,
+                                         colOne, colTwo)
+            else:
+                key = "|".join([digest, projectId, modelId, mode, str(colOne), str(colTwo)] + columns)
+                job = jobs.runner.submit(key, run_optimization_job, projectId, modelId, filepath, digest,
+                                         mode, colOne, colTwo, columns)
+            # AN IDENTICAL SUBMISSION STILL PENDING IS SHARED, AND THIS COPY OF THE UPLOAD IS NOT NEEDED
+            if filepath not in job.args:
+                os.remove(filepath)
+            return redirect(url_for('job_page', jobId=job.id))
+        return render_template("error.html")
     else:
         return "<h1>No Post Request - Invalid Request</h1><br/>"
 
+
+def run_optimization_job(projectId, modelId, filepath, digest, mode, colOne, colTwo, columns, progress=None):
+    store_upload(filepath, digest, progress)
+    proj = cache.get_project(projectId)
+    mods = cache.get_models(proj)
+    mod = cache.get_model(projectId, modelId)
+    feats = cache.get_features_used(mod)
+
+    # READ ONLY THE COLUMNS THE MODEL NEEDS FROM THE STORED UPLOAD, AND SAMPLE THEM
+    # (PROGRESSIVE SAMPLING DECIDES FOR ITSELF HOW MANY OF UP TO PROGRESSIVE_MAX_ROWS IT USES)
+    progress('sampling', 0)
+    sample_size = app.config['PROGRESSIVE_MAX_ROWS'] if mode == "progressive" else app.config['SAMPLE_SIZE']
+    pdata, nrows = load_sample(digest, list(feats) + [proj.target], sample_size)
+
+    scorer = None
+    if app.config['LOCAL_SCORER_PATH']:
+        scorer = scoring.PickleScorer(app.config['LOCAL_SCORER_PATH'], positive_class=proj.positive_class)
+
+    if mode == "adaptive":
+        total, optimised_lb, optimised_ub, changes, report = opti.run_coordinate_ascent(
+                               proj, mod, pdata, columns, scorer=scorer,
+                               compare_limit=app.config['ADAPTIVE_COMPARE_LIMIT'], progress=progress,
+                               sample_size=app.config['SAMPLE_SIZE'], **calibration_options())
+
+        return dict(project=proj,
+                    models=mods, model=mod, total=total, features=feats, nrows=nrows,
+                    optimised_lb=optimised_lb, optimised_ub=optimised_ub,
+                    feature_changes=list(zip(columns, changes)), report=report)
+
+    if mode == "progressive":
+        total, optimised_lb, optimised_ub, f1c, f2c, sampling = opti.run_progressive_brute_force(
+                               proj, mod, pdata, colOne, colTwo, scorer=scorer, progress=progress,
+                               sample_size=sample_size, batch_rows=app.config['PROGRESSIVE_BATCH_ROWS'],
+                               max_width_pct=app.config['PROGRESSIVE_MAX_WIDTH_PCT'],
+                               call_budget=app.config['PROGRESSIVE_CALL_BUDGET'])
+
+        return dict(project=proj,
+                    models=mods, model=mod, total=total, features=feats, nrows=nrows,
+                    optimised_lb=optimised_lb, optimised_ub=optimised_ub,
+                    colone=colOne, coltwo=colTwo,
+                    feat1_change=f1c, feat2_change=f2c, sampling=sampling)
+
+    total, optimised_lb, optimised_ub, f1c, f2c = opti.run_brute_force(proj, mod, pdata, colOne, colTwo,
+                                                                       scorer=scorer, progress=progress,
+                                                                       sample_size=app.config['SAMPLE_SIZE'],
+                                                                       **calibration_options())
+
+    return dict(project=proj,
+                models=mods, model=mod, total=total, features=feats, nrows=nrows,
+                optimised_lb=optimised_lb, optimised_ub=optimised_ub,
+                colone=colOne, coltwo=colTwo,
+                feat1_change=f1c, feat2_change=f2c)
+
+
+def run_comparison_job(projectId, modelIds, filepath, digest, colOne, colTwo, progress=None):
+    store_upload(filepath, digest, progress)
+    proj = cache.get_project(projectId)
+    mods = cache.get_models(proj)
+    chosen = [cache.get_model(projectId, modelId) for modelId in modelIds]
+    feats = sorted(set().union(*[cache.get_features_used(mod) for mod in chosen]))
+
+    # ONE SAMPLE OF THE COLUMNS ANY OF THE CHOSEN MODELS NEEDS, SHARED BY ALL OF THEM
+    progress('sampling', 0)
+    pdata, nrows = load_sample(digest, feats + [proj.target], app.config['SAMPLE_SIZE'])
+
+    scorer = None
+    if app.config['LOCAL_SCORER_PATH']:
+        scorer = scoring.PickleScorer(app.config['LOCAL_SCORER_PATH'], positive_class=proj.positive_class)
+
+    comparison = opti.compare_brute_force(proj, chosen, pdata, colOne, colTwo, scorer=scorer, progress=progress,
+                                          sample_size=app.config['SAMPLE_SIZE'],
+                                          max_workers=app.config['COMPARE_WORKERS'], **calibration_options())
+
+    return dict(project=proj,
+                models=mods, model=chosen[0], total=comparison[0]['total'], features=feats, nrows=nrows,
+                colone=colOne, coltwo=colTwo, comparison=comparison)
+
+
+def store_upload(filepath, digest, progress):
+    # THE STORE KEEPS ONE COLUMNAR COPY PER DISTINCT FILE CONTENT, SO A REPEATED UPLOAD IS NOT PARSED AGAIN
+    progress('storing upload', 0)
+    try:
+        return datasets.store.add(filepath, digest)
+    finally:
+        os.remove(filepath)
+
+
+def load_sample(digest, columns, sample_size):
+    # A RESERVOIR SAMPLE OVER THE STORED PARTS, SO ONLY ONE PART AND THE SAMPLE ARE IN MEMORY AT ONCE
+    return opti.sample_chunks(datasets.store.chunks(digest, columns), sample_size, seed=app.config['SAMPLE_SEED'])
+
+
+def calibration_options():
+    return dict(resampling=app.config['CALIBRATION_RESAMPLING'],
+                resamples=app.config['CALIBRATION_RESAMPLES'],
+                processes=app.config['CALIBRATION_PROCESSES'])
+
+
+# ########################################################################################
+# Background Job Status and Results
+@app.route('/jobs/<jobId>')
+def job_page(jobId):
+    job = jobs.runner.get(jobId)
+    if job == None:
+       return render_template("error.html")
+    return render_template("job_status.html", job=job)
+
+@app.route('/jobs/<jobId>/status')
+def job_status(jobId):
+    job = jobs.runner.get(jobId)
+    if job == None:
+       return jsonify({'id': jobId, 'status': 'unknown'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<jobId>/result')
+def job_result(jobId):
+    job = jobs.runner.get(jobId)
+    if job == None or job.status == 'failed':
+       return render_template("error.html")
+    if job.status != 'done':
+       return redirect(url_for('job_page', jobId=jobId))
+    return render_template("runoptimization.html", **job.result)
+
+# ###################################################################################
+# JSON API
+# GET /api/projects?q=<search>&page=<n>&per_page=<m> returns one page of the project listing.
+# POST /api/roi/batch takes {"jobs": [{"project": id, "analysis": name, "num_models": n,
+# "models": [ids], "scenario": {...}}, ...]} and streams one JSON line per job as each
+# one completes. The jobs run concurrently and share the cached projects, models and
+# ROC curves; the scenario holds the same inputs as the matching HTML form.
+@app.route('/api/projects')
+def api_projects():
+    search = request.args.get("q", "")
+    page, per_page = page_args(app.config['PROJECTS_PER_PAGE'])
+    projs, more = cache.search_projects(search, page, per_page)
+    return jsonify({'page': page, 'per_page': per_page, 'more': more,
+                    'projects': [{'id': p.id, 'project_name': p.project_name,
+                                  'target': getattr(p, 'target', None),
+                                  'target_type': getattr(p, 'target_type', None)} for p in projs]})
+
+def batch_costbenefit(proj, mods, num_models, scenario):
+    return roi.evalBinaryClassModels(project=proj, models=mods, num_models=num_models,
+                                     max_workers=app.config['ROC_FETCH_WORKERS'],
+                                     timeout=app.config['ROC_FETCH_TIMEOUT'], **scenario)
+
+def batch_intervention(proj, mods, num_models, scenario):
+    tp, fp, tn, fn = roi.convertIntervention(**scenario)
+    return roi.evalBinaryClassModels(project=proj, models=mods, num_models=num_models,
+                                     tp=tp, fp=fp, tn=tn, fn=fn, cases=scenario['cases'],
+                                     baserate=scenario['baserate'],
+                                     max_workers=app.config['ROC_FETCH_WORKERS'],
+                                     timeout=app.config['ROC_FETCH_TIMEOUT'])
+
+def batch_capacity(proj, mods, num_models, scenario):
+    results, volumes = roi.evalCapacityModels(project=proj, models=mods, num_models=num_models,
+                                              max_workers=app.config['ROC_FETCH_WORKERS'],
+                                              timeout=app.config['ROC_FETCH_TIMEOUT'], **scenario)
+    return {'models': results, 'volumes': volumes}
+
+def batch_regression(analysis):
+    def evaluate(proj, mods, num_models, scenario):
+        return roi.evalRegressionModels(project=proj, models=mods, num_models=num_models, analysis=analysis,
+                                        max_workers=app.config['ROC_FETCH_WORKERS'],
+                                        timeout=app.config['ROC_FETCH_TIMEOUT'], **scenario)
+    return evaluate
+
+BATCH_ANALYSES = {'costbenefit': batch_costbenefit,
+                  'intervention': batch_intervention,
+                  'capacity': batch_capacity,
+                  'regression_discrete': batch_regression(roi.discreteErrorCost),
+                  'regression_continuous': batch_regression(roi.continuousErrorCost),
+                  'regression_aggregate': batch_regression(roi.aggregateErrorCost)}
+
+def run_batch_job(number, spec):
+    proj = cache.get_project(spec['project'])
+    mods = cache.get_models(proj)
+    if 'models' in spec:
+        mods = [mod for mod in mods if mod.id in set(spec['models'])]
+    num_models = int(spec.get('num_models', len(mods)))
+    results = BATCH_ANALYSES[spec['analysis']](proj, mods, num_models, spec.get('scenario', {}))
+    return {'job': number, 'project': proj.id, 'analysis': spec['analysis'], 'results': results}
+
+@app.route('/api/roi/batch', methods = ['POST'])
+def api_roi_batch():
+    specs = (request.get_json(silent=True) or {}).get('jobs', [])
+
+    def stream():
+        executor = ThreadPoolExecutor(max_workers=max(1, min(app.config['BATCH_WORKERS'], len(specs))))
+        futures = {executor.submit(run_batch_job, number, spec): number for number, spec in enumerate(specs)}
+        try:
+            for future in as_completed(futures):
+                try:
+                    line = future.result()
+                except Exception as e:
+                    log.warning("Batch job %i failed: %s", futures[future], e)
+                    line = {'job': futures[future], 'error': str(e)}
+                yield json.dumps(line) + "\n"
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+
+# ###################################################################################
+# Cache Statistics
+@app.route('/cachestats')
+def cachestats():
+    stats = cache.store.stats()
+    stats['datasets'] = datasets.store.stats()
+    return jsonify(stats)
+
+
+# ###################################################################################
+# Prometheus Metrics
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 # ###################################################################################
 # About Page
 @app.route('/about')
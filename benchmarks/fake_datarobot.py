@@ -0,0 +1,129 @@
+# ##############################################################################################################
+# AN IN-PROCESS STAND-IN FOR THE PARTS OF THE datarobot CLIENT THIS APP USES
+#
+# install() registers this module as 'datarobot' so that roi.py, opti.py and friends import it instead
+# of the real client. Projects hold synthetic models with synthetic ROC curves; uploaded datasets are
+# kept in memory and "scored" with a deterministic function of the row contents. Counters record how
+# many remote calls of each kind were made.
+# ##############################################################################################################
+
+from collections import Counter
+import types
+import sys
+import itertools
+import numpy as np
+import pandas as pd
+
+import synthetic
+
+calls = Counter()
+projects = {}
+datasets = {}
+predict_jobs = {}
+ids = itertools.count(1)
+
+
+def next_id(prefix):
+    return "%s%06d" % (prefix, next(ids))
+
+
+class RocCurve(object):
+
+    def __init__(self, roc_points):
+        self.roc_points = roc_points
+
+
+class Model(object):
+
+    def __init__(self, project, index, roc_size, features):
+        self.id = next_id('model')
+        self.project_id = project.id
+        self.project = project
+        self.model_type = "Synthetic Model %i" % index
+        self.sample_pct = 64.0
+        self.featurelist_name = "Synthetic Features"
+        self.featurelist_id = "featurelist"
+        self.metrics = {project.metric: {'validation': 0.5 + index / 1000.0}}
+        self.roc_points = synthetic.roc_points(roc_size, seed=index)
+        self.features = features
+        self.weights = np.random.default_rng(index).normal(size=len(features))
+
+    @classmethod
+    def get(cls, project_id, model_id):
+        calls['Model.get'] += 1
+        return [m for m in projects[project_id].models if m.id == model_id][0]
+
+    def get_roc_curve(self, partition):
+        calls['get_roc_curve'] += 1
+        return RocCurve(self.roc_points)
+
+    def get_features_used(self):
+        calls['get_features_used'] += 1
+        return list(self.features)
+
+    def request_predictions(self, dataset_id):
+        calls['request_predictions'] += 1
+        job_id = next_id('job')
+        predict_jobs[job_id] = (self, dataset_id)
+        return types.SimpleNamespace(id=job_id)
+
+    def predict(self, pdata):
+        hashed = pd.util.hash_pandas_object(pdata[self.features], index=False).values
+        signal = (hashed % 1000003) / 1000003.0
+        return 1 / (1 + np.exp(-4 * (signal - 0.8)))
+
+
+class Project(object):
+
+    def __init__(self, num_models=10, roc_size=100, features=None, target='target', positive_class=1):
+        self.id = next_id('project')
+        self.project_name = "Synthetic Project %s" % self.id
+        self.metric = 'LogLoss'
+        self.target = target
+        self.target_type = 'Binary'
+        self.positive_class = positive_class
+        features = features if features is not None else ['x%i' % i for i in range(5)]
+        self.models = [Model(self, i, roc_size, features) for i in range(num_models)]
+        projects[self.id] = self
+
+    @classmethod
+    def get(cls, project_id):
+        calls['Project.get'] += 1
+        return projects[project_id]
+
+    @classmethod
+    def list(cls, search_params=None, offset=None, limit=None):
+        calls['Project.list'] += 1
+        found = list(projects.values())
+        if search_params:
+            found = [p for p in found if search_params['project_name'].lower() in p.project_name.lower()]
+        start = offset or 0
+        return found[start:start + limit] if limit else found[start:]
+
+    def get_models(self):
+        calls['get_models'] += 1
+        return list(self.models)
+
+    def upload_dataset(self, pdata):
+        calls['upload_dataset'] += 1
+        dataset_id = next_id('dataset')
+        datasets[dataset_id] = pdata
+        return types.SimpleNamespace(id=dataset_id)
+
+
+def wait_for_async_predictions(project_id, predict_job_id, max_wait=600):
+    calls['wait_for_async_predictions'] += 1
+    model, dataset_id = predict_jobs.pop(predict_job_id)
+    pdata = datasets[dataset_id]
+    positive = model.predict(pdata)
+    return pd.DataFrame({'row_id': np.arange(len(pdata)),
+                         'prediction': (positive >= 0.5).astype(int),
+                         'positive_probability': positive})
+
+
+def install():
+    module = sys.modules[__name__]
+    module.models = types.SimpleNamespace(predict_job=types.SimpleNamespace(
+                                              wait_for_async_predictions=wait_for_async_predictions))
+    sys.modules['datarobot'] = module
+    return module
@@ -0,0 +1,159 @@
+# ##############################################################################################################
+# OFFLINE BENCHMARKS
+#
+# Times the ROI and optimisation code paths against the in-process fake DataRobot client over a range of
+# scaling parameters, and writes one JSON record per measurement so runs can be compared. Run from the
+# repository root:
+#
+#    python benchmarks/run_benchmarks.py --output bench_results.json
+#    python benchmarks/run_benchmarks.py --quick
+# ##############################################################################################################
+
+import argparse
+import platform
+import tempfile
+import time
+import json
+import sys
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.dirname(HERE))
+
+import fake_datarobot
+fake_datarobot.install()
+
+import numpy as np
+import synthetic
+import scoring
+import cache
+import datasets
+import roi
+import opti
+
+
+def reset_caches():
+    # NOTHING IS KEPT BETWEEN REPEATS, SO EVERY TIMING INCLUDES THE (FAKE) REMOTE CALLS
+    cache.store = cache.Cache(None, None, cache.Config.CACHE_MAX_ITEMS)
+    cache.listing = cache.Cache(None, None, cache.Config.CACHE_MAX_ITEMS)
+    cache.leaderboard = cache.Cache(None, None, cache.Config.CACHE_MAX_ITEMS)
+    cache.predictions = cache.PredictionCache(':memory:', cache.Config.PREDICTION_CACHE_MAX_ROWS)
+    datasets.store = datasets.DatasetStore(tempfile.mkdtemp(), cache.Config.DATASET_MAX_BYTES)
+    opti.profile_cache.clear()
+    fake_datarobot.calls.clear()
+
+
+def measure(name, params, fn, repeats):
+    times = []
+    for i in range(repeats):
+        reset_caches()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    record = {'name': name, 'params': params, 'repeats': repeats,
+              'best_seconds': min(times), 'mean_seconds': sum(times) / len(times),
+              'remote_calls': dict(fake_datarobot.calls)}
+    print("%-32s %-60s %10.4fs" % (name, json.dumps(params), record['best_seconds']))
+    return record
+
+
+##################################################################################################################
+# ROI BENCHMARKS
+##################################################################################################################
+def bench_roi(models_grid, points_grid, scenarios_grid, repeats):
+    results = []
+    for num_models in models_grid:
+        for roc_size in points_grid:
+            project = fake_datarobot.Project(num_models=num_models, roc_size=roc_size)
+            models = project.get_models()
+            params = {'models': num_models, 'roc_points': roc_size}
+            results.append(measure('evalBinaryClassModels', params, lambda: roi.evalBinaryClassModels(
+                project, models, num_models, 1000, -200, 0, 0, 1000, 0.01), repeats))
+            results.append(measure('estimateOptimalThreshold', params, lambda: roi.estimateOptimalThreshold(
+                models[0], 1000, -200, 0, 0, 1000, 0.01), repeats))
+            point_lists = [m.roc_points for m in models]
+            for num_scenarios in scenarios_grid:
+                tp = np.linspace(100, 5000, num_scenarios)
+                params = {'models': num_models, 'roc_points': roc_size, 'scenarios': num_scenarios}
+                results.append(measure('sweepOptimalThresholds', params, lambda: roi.sweepOptimalThresholds(
+                    point_lists, tp, -200, 0, 0, 1000, 0.01), repeats))
+    return results
+
+
+##################################################################################################################
+# OPTIMISATION BENCHMARKS
+##################################################################################################################
+def bench_opti(rows_grid, cardinality_grid, repeats):
+    results = []
+    for rows in rows_grid:
+        for cardinality in cardinality_grid:
+            cardinalities = [cardinality, cardinality, 5, None]
+            data = synthetic.tabular(rows, cardinalities)
+            features = [c for c in data.columns if c != 'target']
+            project = fake_datarobot.Project(num_models=1, features=features)
+            model = project.get_models()[0]
+            params = {'rows': rows, 'cardinality': cardinality}
+
+            # EVERY ROW IS USED, SO THE rows GRID REALLY SCALES THE WORK
+            results.append(measure('run_brute_force', params, lambda: opti.run_brute_force(
+                project, model, data, 'x0', 'x1', sample_size=rows), repeats))
+
+            sample = data
+            results.append(measure('sample_down', params, lambda: opti.sample_down(data), repeats))
+            results.append(measure('profile_feature', params,
+                                   lambda: [opti.profile_feature(sample, c) for c in features], repeats))
+            vals1 = opti.profile_feature(sample, 'x0').values
+            vals2 = opti.profile_feature(sample, 'x1').values
+            results.append(measure('iter_simulated_data', params, lambda: [len(b) for b in
+                                   opti.iter_simulated_data(sample, 'x0', vals1, 'x1', vals2)], repeats))
+            scorer = scoring.DataRobotScorer(project, model)
+            results.append(measure('score_permutations', params, lambda: [len(b) for b in
+                                   scoring.score_stream(scorer, opti.iter_simulated_data(
+                                       sample, 'x0', vals1, 'x1', vals2))], repeats))
+            scores = np.random.default_rng(0).uniform(size=len(sample) * len(vals1) * len(vals2))
+            results.append(measure('get_optimal_combinations', params, lambda: opti.get_optimal_combinations(
+                scores, len(sample), vals1, vals2), repeats))
+            preds = scoring.score_frame(scorer, sample)
+            results.append(measure('calibrate', params, lambda: opti.calibrate(
+                sample, preds, project.target, project.positive_class), repeats))
+            maxvals, onevals, twovals = opti.get_optimal_combinations(scores, len(sample), vals1, vals2)
+            profiles = [(opti.profile_feature(sample, 'x0'), onevals), (opti.profile_feature(sample, 'x1'), twovals)]
+            results.append(measure('kl', params, lambda: [opti.calculate_feature_distribution_change(
+                profile.dist, opti.add_pseudo_counts(opti.calculate_feature_distribution(
+                    profile.values, chosen, profile.edges))) for profile, chosen in profiles], repeats))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the ROI estimation app")
+    parser.add_argument('--output', default='bench_results.json', help="file to write the JSON results to")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help="run a small grid only")
+    parser.add_argument('--only', choices=['roi', 'opti'], default=None)
+    args = parser.parse_args()
+
+    if args.quick:
+        grids = dict(models=[5], points=[100], scenarios=[10], rows=[200], cardinality=[10])
+    else:
+        grids = dict(models=[5, 20, 50], points=[100, 1000], scenarios=[1, 100, 1000],
+                     rows=[200, 1000, 5000], cardinality=[5, 15, 30])
+
+    results = []
+    if args.only in (None, 'roi'):
+        results += bench_roi(grids['models'], grids['points'], grids['scenarios'], args.repeats)
+    if args.only in (None, 'opti'):
+        results += bench_opti(grids['rows'], grids['cardinality'], args.repeats)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'machine': platform.machine(),
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("Wrote %i results to %s" % (len(results), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+# ##############################################################################################################
+# SYNTHETIC DATA FOR THE BENCHMARKS
+# ##############################################################################################################
+
+import numpy as np
+import pandas as pd
+
+
+##################################################################################################################
+# A PLAUSIBLE ROC CURVE WITH n POINTS - RATES ARE MONOTONE IN THE THRESHOLD
+##################################################################################################################
+def roc_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    thresholds = np.sort(rng.uniform(0, 1, n))[::-1]
+    fpr = np.sort(rng.uniform(0, 1, n))
+    tpr = np.clip(fpr ** rng.uniform(0.2, 0.6), fpr, 1)
+    return [{'threshold': float(t), 'false_positive_rate': float(f), 'true_negative_rate': float(1 - f),
+             'true_positive_rate': float(p)} for t, f, p in zip(thresholds, fpr, tpr)]
+
+
+##################################################################################################################
+# A TABLE WITH ONE COLUMN PER ENTRY OF cardinalities - A CARDINALITY OF None GIVES A CONTINUOUS COLUMN -
+# AND A BINARY TARGET WITH THE GIVEN BASE RATE
+##################################################################################################################
+def tabular(rows, cardinalities, seed=0, target='target', baserate=0.2):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i, cardinality in enumerate(cardinalities):
+        if cardinality is None:
+            data['x%i' % i] = rng.normal(size=rows)
+        else:
+            data['x%i' % i] = rng.integers(0, cardinality, size=rows)
+    data[target] = (rng.uniform(size=rows) < baserate).astype(int)
+    return pd.DataFrame(data)
@@ -0,0 +1,355 @@
+# ##############################################################################################################
+# CACHE OF DATAROBOT ARTIFACTS
+#
+# Trained models do not change, so their ROC curves and other per-model artifacts can be kept between
+# requests. Entries live in an in-process LRU with a size cap, backed by a pickle file per key in the cache
+# folder so they survive restarts. Both layers honour the same TTL; expired files are deleted when read and
+# the oldest files are removed when the folder holds more than max_files. A project and its leaderboard
+# change as models are trained, so they are kept in a separate in-memory cache with a short TTL.
+# ##############################################################################################################
+
+from collections import OrderedDict
+import datarobot as dr
+import numpy as np
+import pandas as pd
+import threading
+import sqlite3
+import tempfile
+import pickle
+import time
+import os
+
+from config import Config
+import metrics
+
+
+class Cache(object):
+
+    def __init__(self, folder, ttl, max_items, max_files=None):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_files = max_files
+        self.items = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.files = 0
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            self.files = len(self.stored_files())
+
+    def path(self, key):
+        name = "_".join(str(k) for k in key)
+        return os.path.join(self.folder, name + ".pkl")
+
+    def expired(self, stamp):
+        return self.ttl is not None and (time.time() - stamp) > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                stamp, value = self.items[key]
+                if not self.expired(stamp):
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.items[key]
+        if self.folder and os.path.exists(self.path(key)):
+            try:
+                with open(self.path(key), 'rb') as f:
+                    stamp, value = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                stamp, value = None, None
+            if stamp is not None and not self.expired(stamp):
+                with self.lock:
+                    self.remember(key, stamp, value)
+                    self.disk_hits += 1
+                return True, value
+            self.remove(self.path(key))
+        with self.lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        stamp = time.time()
+        with self.lock:
+            self.remember(key, stamp, value)
+        if self.folder:
+            temp = self.path(key) + ".%s.tmp" % threading.get_ident()
+            existed = os.path.exists(self.path(key))
+            with open(temp, 'wb') as f:
+                pickle.dump((stamp, value), f)
+            os.replace(temp, self.path(key))
+            with self.lock:
+                self.files = self.files + (0 if existed else 1)
+                if self.max_files is not None and self.files > self.max_files:
+                    self.prune()
+
+    def stored_files(self):
+        return [os.path.join(self.folder, name) for name in os.listdir(self.folder) if name.endswith(".pkl")]
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+            with self.lock:
+                self.files = max(0, self.files - 1)
+        except OSError:
+            pass
+
+    def prune(self):
+        # DROP THE OLDEST FILES DOWN TO 90% OF max_files, SO WE DO NOT LIST THE FOLDER ON EVERY WRITE
+        paths = sorted(self.stored_files(), key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        self.files = len(paths)
+        for path in paths[0:max(0, len(paths) - int(0.9 * self.max_files))]:
+            self.remove(path)
+
+    def remember(self, key, stamp, value):
+        self.items[key] = (stamp, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def get_or_fetch(self, key, fetch):
+        found, value = self.get(key)
+        if not found:
+            value = fetch()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+        if self.folder:
+            for path in self.stored_files():
+                self.remove(path)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'items': len(self.items), 'max_items': self.max_items, 'ttl': self.ttl,
+                    'files': self.files, 'max_files': self.max_files}
+
+
+store = Cache(Config.CACHE_FOLDER, Config.CACHE_TTL, Config.CACHE_MAX_ITEMS, Config.CACHE_MAX_FILES)
+leaderboard = Cache(None, Config.LEADERBOARD_TTL, Config.CACHE_MAX_ITEMS)
+
+
+##################################################################################################################
+# CACHED DATAROBOT LOOKUPS
+##################################################################################################################
+def remote(call, fetch):
+    def timed_fetch():
+        with metrics.remote_call(call):
+            return fetch()
+    return timed_fetch
+
+# THE PROJECT LISTING CHANGES AS PROJECTS ARE CREATED, SO PAGES OF IT ARE ONLY KEPT IN MEMORY FOR A SHORT TIME.
+# DATAROBOT DOES THE NAME SEARCH AND THE PAGING, SO ONLY THE PAGE SHOWN IS DOWNLOADED.
+listing = Cache(None, Config.PROJECT_LIST_TTL, Config.CACHE_MAX_ITEMS)
+
+def search_projects(search=None, page=1, per_page=50):
+    # ONE PAGE OF THE PROJECTS WHOSE NAME MATCHES search, AND WHETHER MORE FOLLOW IT (ONE EXTRA IS ASKED FOR)
+    page = max(page, 1)
+    search_params = {'project_name': search} if search else None
+    def fetch():
+        return dr.Project.list(search_params=search_params, offset=(page - 1) * per_page, limit=per_page + 1)
+    projs = listing.get_or_fetch(('projects', search or '', page, per_page), remote('Project.list', fetch))
+    return projs[0:per_page], len(projs) > per_page
+
+def get_project(project_id):
+    return leaderboard.get_or_fetch(('project', project_id),
+                              remote('Project.get', lambda: dr.Project.get(project_id=project_id)))
+
+def get_models(project):
+    return leaderboard.get_or_fetch(('models', project.id), remote('get_models', project.get_models))
+
+def get_model(project_id, model_id):
+    return store.get_or_fetch(('model', project_id, model_id),
+                              remote('Model.get', lambda: dr.Model.get(project_id, model_id)))
+
+def get_features_used(model):
+    return store.get_or_fetch(('features', model.project_id, model.id),
+                              remote('get_features_used', model.get_features_used))
+
+def get_roc_points(model, partition='validation'):
+    return store.get_or_fetch(('roc', model.project_id, model.id, partition),
+                              remote('get_roc_curve', lambda: model.get_roc_curve(partition).roc_points))
+
+def get_residuals(model, partition='validation'):
+    # ACTUALS AND PREDICTIONS OF A REGRESSION MODEL AS COMPACT float32 ARRAYS. THE RESIDUALS CHART IS A
+    # RANDOM SAMPLE OF AT MOST 1000 ROWS, SO THIS IS ONLY USED WHEN get_validation_residuals CANNOT BE
+    # (THE PROJECT'S ACTUALS ARE NOT IN THE AI CATALOG)
+    def fetch():
+        data = np.asarray(model.get_residuals_chart(source=partition).data, dtype=np.float64)
+        return data[:, 0].astype(np.float32), data[:, 1].astype(np.float32)
+    return store.get_or_fetch(('residuals', model.project_id, model.id, partition),
+                              remote('get_residuals_chart', fetch))
+
+
+##################################################################################################################
+# VALIDATION PREDICTIONS
+# THE POSITIVE CLASS PROBABILITY (float32) AND THE ACTUAL (int8, 1 FOR THE POSITIVE CLASS) OF EVERY
+# VALIDATION ROW OF A BINARY MODEL, OR THE ACTUAL AND PREDICTED VALUES OF A REGRESSION MODEL. THE
+# PREDICTIONS COME FROM THE MODEL'S TRAINING PREDICTIONS AND THE ACTUALS FROM THE PROJECT'S TRAINING DATA
+# IN THE AI CATALOG, MATCHED ON row_id. THEY ARE DOWNLOADED ONCE AND KEPT AS .npy FILES THAT ARE MEMORY
+# MAPPED WHEN READ. A PROJECT CREATED FROM AN UPLOADED FILE HAS NO CATALOG DATASET, SO THERE ARE NO
+# ACTUALS TO READ (SEE actuals_available).
+##################################################################################################################
+class ActualsUnavailable(Exception):
+    pass
+
+def actuals_available(project):
+    return getattr(project, 'catalog_id', None) is not None
+
+download_locks = {}
+download_lock = threading.Lock()
+
+def key_lock(key):
+    # ONE LOCK PER DOWNLOAD, SO CONCURRENT FIRST REQUESTS FOR THE SAME MODEL FETCH AND WRITE IT ONCE
+    with download_lock:
+        return download_locks.setdefault(key, threading.Lock())
+
+def save_arrays(base, arrays):
+    # THE LAST ARRAY IS WRITTEN LAST, SO ITS FILE EXISTING MEANS ALL OF THEM ARE COMPLETE
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    for suffix, values in arrays:
+        temp = "%s%s.%s.tmp" % (base, suffix, threading.get_ident())
+        with open(temp, 'wb') as f:
+            np.save(f, values)
+        os.replace(temp, base + suffix)
+
+def get_validation_predictions(model):
+    base = os.path.join(Config.CACHE_FOLDER, 'validation', "%s_%s" % (model.project_id, model.id))
+    with key_lock(base):
+        if not os.path.exists(base + "_actual.npy"):
+            project = get_project(model.project_id)
+            preds, targets = get_validation_rows(project, model)
+            probability = preds['class_%s' % project.positive_class].values.astype(np.float32)
+            actual = (targets == project.positive_class).astype(np.int8)
+            save_arrays(base, [("_probability.npy", probability), ("_actual.npy", actual)])
+    return np.load(base + "_probability.npy", mmap_mode='r'), np.load(base + "_actual.npy", mmap_mode='r')
+
+def get_validation_residuals(model):
+    # EVERY VALIDATION ROW OF A REGRESSION MODEL: (ACTUAL, PREDICTED) AS float32
+    base = os.path.join(Config.CACHE_FOLDER, 'validation', "%s_%s" % (model.project_id, model.id))
+    with key_lock(base):
+        if not os.path.exists(base + "_residual_actual.npy"):
+            project = get_project(model.project_id)
+            preds, targets = get_validation_rows(project, model)
+            save_arrays(base, [("_residual_predicted.npy", preds['prediction'].values.astype(np.float32)),
+                               ("_residual_actual.npy", targets.astype(np.float32))])
+    return np.load(base + "_residual_actual.npy", mmap_mode='r'), \
+           np.load(base + "_residual_predicted.npy", mmap_mode='r')
+
+# ONLY THESE TRAINING PREDICTION SUBSETS INCLUDE THE VALIDATION ROWS (THE VALUES OF dr.enums.DATA_SUBSET.ALL
+# AND VALIDATION_AND_HOLDOUT, SPELT OUT SO THIS MODULE IMPORTS WITHOUT THE CLIENT'S ENUMS)
+VALIDATION_SUBSETS = set(['all', 'validationAndHoldout'])
+
+def get_validation_rows(project, model):
+    # THE TRAINING PREDICTIONS OF THE VALIDATION PARTITION AND THE ACTUAL TARGET OF EACH OF THOSE ROWS. RAISES
+    # WHEN THERE ARE NO VALIDATION ROWS, SO THE MODEL SHOWS AS UNAVAILABLE RATHER THAN WITH A MADE UP RESULT.
+    targets = get_training_targets(project)
+    with metrics.remote_call('training_predictions'):
+        found = [p for p in dr.TrainingPredictions.list(model.project_id)
+                 if p.model_id == model.id and str(p.data_subset) in VALIDATION_SUBSETS]
+        if len(found) > 0:
+            training = found[0]
+        else:
+            job = model.request_training_predictions(dr.enums.DATA_SUBSET.VALIDATION_AND_HOLDOUT)
+            training = job.get_result_when_complete()
+        preds = training.get_all_as_dataframe()
+    preds = preds[preds['partition_id'].astype(str) == '0.0']
+    if len(preds) == 0:
+        raise ValueError("Model %s has no validation predictions" % model.id)
+    return preds, targets[preds['row_id'].values]
+
+def get_training_targets(project):
+    # ONLY THE TARGET COLUMN IS PARSED FROM THE CATALOG FILE, WHICH IS STREAMED TO A TEMPORARY FILE
+    def fetch():
+        if not actuals_available(project):
+            raise ActualsUnavailable("Project %s was not created from an AI Catalog dataset" % project.id)
+        response = dr.client.get_client().get("datasets/%s/file/" % project.catalog_id, stream=True)
+        with tempfile.NamedTemporaryFile(suffix=".data") as f:
+            for block in response.iter_content(1 << 20):
+                f.write(block)
+            f.flush()
+            with open(f.name, 'rb') as check:
+                parquet = check.read(4) == b"PAR1"
+            if parquet:
+                return pd.read_parquet(f.name, columns=[project.target])[project.target].values
+            chunks = pd.read_csv(f.name, usecols=[project.target], chunksize=500000)
+            return pd.concat(chunks)[project.target].values
+    return store.get_or_fetch(('targets', project.id), remote('get_dataset', fetch))
+
+
+# ##############################################################################################################
+# PREDICTION CACHE
+#
+# Predictions keyed by a scope (the model and the set of columns scored) and a stable 64-bit hash of the
+# row's feature values. Stored in a single SQLite file so it is shared between runs; when it grows past
+# max_rows the least recently used rows are evicted.
+# ##############################################################################################################
+class PredictionCache(object):
+
+    CHUNK = 500
+
+    def __init__(self, path, max_rows):
+        self.path = path
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS predictions "
+                          "(scope TEXT, row INTEGER, prediction, probability REAL, used REAL, "
+                          "PRIMARY KEY (scope, row))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)")
+        self.conn.commit()
+
+    def lookup(self, scope, rows):
+        # RETURNS {row: (prediction, probability)} FOR THE ROWS THAT ARE CACHED
+        found = {}
+        rows = [int(r) for r in rows]
+        with self.lock:
+            for start in range(0, len(rows), self.CHUNK):
+                chunk = rows[start:start + self.CHUNK]
+                marks = ",".join("?" * len(chunk))
+                cursor = self.conn.execute("SELECT row, prediction, probability FROM predictions "
+                                           "WHERE scope = ? AND row IN (%s)" % marks, [scope] + chunk)
+                for row, prediction, probability in cursor:
+                    found[row] = (prediction, probability)
+                self.conn.execute("UPDATE predictions SET used = ? WHERE scope = ? AND row IN (%s)" % marks,
+                                  [time.time(), scope] + chunk)
+            self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(rows) - len(found)
+        return found
+
+    def save(self, scope, rows, predictions, probabilities):
+        now = time.time()
+        records = [(scope, int(r), p, float(q), now) for r, p, q in zip(rows, predictions, probabilities)]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)", records)
+            count = self.conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            if count > self.max_rows:
+                self.conn.execute("DELETE FROM predictions WHERE rowid IN "
+                                  "(SELECT rowid FROM predictions ORDER BY used LIMIT ?)", (count - self.max_rows,))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM predictions")
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'rows': count, 'max_rows': self.max_rows}
+
+
+predictions = PredictionCache(Config.PREDICTION_CACHE_PATH, Config.PREDICTION_CACHE_MAX_ROWS)
@@ -3,4 +3,53 @@ import os
 class Config(object):
     SECRET_KEY = 'replace_this_for_security'
     UPLOAD_FOLDER = './uploads'
+    # CACHE OF ROC CURVES AND PROJECT/MODEL METADATA
+    CACHE_FOLDER = './cache'
+    CACHE_TTL = 24 * 60 * 60
+    CACHE_MAX_ITEMS = 2000
+    CACHE_MAX_FILES = 20000
+    # PROJECTS AND THEIR LEADERBOARDS CHANGE AS MODELS ARE TRAINED, SO THEY ARE KEPT FOR A SHORT TIME ONLY
+    LEADERBOARD_TTL = 300
+    # PROJECT LISTING: SECONDS IT IS KEPT, AND PROJECTS SHOWN PER PAGE
+    PROJECT_LIST_TTL = 300
+    PROJECTS_PER_PAGE = 50
+    PROJECTS_MAX_PER_PAGE = 200
+    # CONCURRENT JOBS IN ONE /api/roi/batch REQUEST
+    BATCH_WORKERS = 8
+    # CACHE OF PREDICTIONS KEYED BY MODEL AND ROW CONTENTS
+    PREDICTION_CACHE_PATH = './cache/predictions.sqlite'
+    PREDICTION_CACHE_MAX_ROWS = 5000000
+    # COLUMNAR COPIES OF UPLOADED DATASETS, KEYED BY CONTENT HASH
+    DATASET_FOLDER = './cache/datasets'
+    DATASET_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    # ROWS PARSED AT A TIME WHEN AN UPLOAD IS CONVERTED, AND THE MOST PREDICTION DATASET IDS REMEMBERED
+    DATASET_CHUNK_ROWS = 100000
+    DATASET_MAX_REMOTE = 1000
+    # CONCURRENT RETRIEVAL OF ROC CURVES
+    ROC_FETCH_WORKERS = 8
+    ROC_FETCH_TIMEOUT = 60
+    # SCORE OPTIMIZATIONS WITH A PICKLED SCIKIT-LEARN MODEL INSTEAD OF DATAROBOT (OFFLINE RUNS)
+    LOCAL_SCORER_PATH = None
+    # ADAPTIVE SEARCH ALSO RUNS THE FULL GRID WHEN IT NEEDS NO MORE THAN THIS MANY SCORES
+    ADAPTIVE_COMPARE_LIMIT = 20000
+    # WORKER THREADS FOR BACKGROUND OPTIMIZATION JOBS
+    JOB_WORKERS = 2
+    # ROWS SAMPLED FROM AN OPTIMIZATION UPLOAD (SEED None GIVES A DIFFERENT SAMPLE EACH RUN)
+    SAMPLE_SIZE = 1000
+    SAMPLE_SEED = None
+    # CALIBRATION BOUNDS FROM RESAMPLED SPLITS ('bootstrap', 'kfold' OR None FOR THE SINGLE MIDPOINT SPLIT),
+    # AND THE SPAWNED PROCESSES TO SHARE THE RESAMPLES OVER (1 RUNS THEM IN THE JOB THREAD)
+    CALIBRATION_RESAMPLING = None
+    CALIBRATION_RESAMPLES = 200
+    CALIBRATION_PROCESSES = 1
+    # PROGRESSIVE SAMPLING: ROWS IN THE FIRST BATCH, MOST ROWS USED, AND THE STOPPING RULES
+    # (INTERVAL WIDTH AS A PERCENT OF ITS MIDPOINT, AND A SCORING CALL BUDGET - None FOR NO BUDGET)
+    PROGRESSIVE_BATCH_ROWS = 100
+    PROGRESSIVE_MAX_ROWS = 5000
+    PROGRESSIVE_MAX_WIDTH_PCT = 10.0
+    PROGRESSIVE_CALL_BUDGET = None
+    # MODELS SCORED AT ONCE WHEN SEVERAL ARE COMPARED ON THE SAME OPTIMISATION
+    COMPARE_WORKERS = 4
+    # SEED FOR MONTE CARLO ROI SIMULATION (None GIVES DIFFERENT DRAWS EACH TIME)
+    SIMULATION_SEED = 0
 
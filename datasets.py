@@ -0,0 +1,193 @@
+# ##############################################################################################################
+# DATASET STORE
+#
+# Uploaded files are identified by a hash of their contents and parsed only once: the first time a file is
+# seen it is read from CSV in chunks of chunk_rows rows, and each chunk is written to the store as a Feather
+# part (or a pickle when pyarrow is not installed), so converting a file never holds more than one chunk in
+# memory. Later analyses of the same file read just the columns they need from those parts, memory mapped,
+# one part at a time. When the files grow past max_bytes the least recently used ones are removed.
+#
+# The index also remembers the DataRobot prediction dataset created for a frame in each project, so a frame
+# that has already been uploaded is not sent again. At most max_remote of those are kept, dropping the least
+# recently used. The index is a JSON file in the store folder.
+# ##############################################################################################################
+
+import pandas as pd
+import threading
+import hashlib
+import json
+import time
+import os
+
+from config import Config
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+
+class DatasetStore(object):
+
+    def __init__(self, folder, max_bytes, max_remote=1000, chunk_rows=100000):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_remote = max_remote
+        self.chunk_rows = chunk_rows
+        self.lock = threading.RLock()
+        self.locks = {}
+        os.makedirs(folder, exist_ok=True)
+        self.index_path = os.path.join(folder, "index.json")
+        self.index = {'files': {}, 'remote': {}}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def save_index(self):
+        temp = self.index_path + ".tmp"
+        with open(temp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(temp, self.index_path)
+
+    def key_lock(self, digest):
+        with self.lock:
+            return self.locks.setdefault(digest, threading.Lock())
+
+    def stored(self, digest):
+        entry = self.index['files'].get(digest)
+        return entry is not None and all(os.path.exists(os.path.join(self.folder, p)) for p in entry['parts'])
+
+    def add(self, filepath, digest=None):
+        # RETURNS THE DIGEST OF THE FILE (PASS IT IF ALREADY KNOWN), CONVERTING THE FILE TO THE COLUMNAR FORMAT
+        # IF IT IS NEW. THE CONVERSION HOLDS ONLY THE LOCK OF THIS DIGEST, SO OTHER FILES CAN BE ADDED AND READ
+        # MEANWHILE.
+        if digest is None:
+            digest = file_digest(filepath)
+        with self.key_lock(digest):
+            with self.lock:
+                if self.stored(digest):
+                    self.index['files'][digest]['used'] = time.time()
+                    self.save_index()
+                    return digest
+            entry = self.convert(filepath, digest)
+            with self.lock:
+                self.index['files'][digest] = entry
+                self.evict()
+                self.save_index()
+        return digest
+
+    def convert(self, filepath, digest):
+        parts, rows, columns = [], 0, None
+        chunks = pd.read_csv(filepath, chunksize=self.chunk_rows)
+        for number, chunk in enumerate(chunks):
+            parts.append(self.write_part(chunk, "%s.%04d" % (digest, number)))
+            rows = rows + len(chunk)
+            columns = [str(c) for c in chunk.columns]
+        if len(parts) == 0:
+            empty = pd.read_csv(filepath, nrows=0)
+            parts.append(self.write_part(empty, "%s.0000" % digest))
+            columns = [str(c) for c in empty.columns]
+        return {'parts': parts, 'rows': rows, 'used': time.time(), 'columns': columns,
+                'bytes': sum(os.path.getsize(os.path.join(self.folder, p)) for p in parts)}
+
+    def write_part(self, pdata, name):
+        pdata = pdata.reset_index(drop=True)
+        pdata.columns = [str(c) for c in pdata.columns]
+        if feather is not None:
+            name = name + ".feather"
+            feather.write_feather(pdata, os.path.join(self.folder, name))
+        else:
+            name = name + ".pkl"
+            pdata.to_pickle(os.path.join(self.folder, name))
+        return name
+
+    def chunks(self, digest, columns=None):
+        # YIELDS THE STORED FILE ONE PART AT A TIME, WITH ONLY THE GIVEN COLUMNS
+        with self.lock:
+            entry = self.index['files'][digest]
+            entry['used'] = time.time()
+            self.save_index()
+        if columns is not None:
+            columns = [c for c in entry['columns'] if c in set(columns)]
+        for part in entry['parts']:
+            path = os.path.join(self.folder, part)
+            if part.endswith(".feather"):
+                yield feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+            else:
+                pdata = pd.read_pickle(path)
+                yield pdata if columns is None else pdata[columns]
+
+    def load(self, digest, columns=None):
+        return pd.concat(list(self.chunks(digest, columns)), ignore_index=True)
+
+    def rows(self, digest):
+        with self.lock:
+            return self.index['files'][digest]['rows']
+
+    def remote_id(self, project_id, digest):
+        with self.lock:
+            entry = self.index['remote'].get(project_id + ":" + digest)
+            if entry is None:
+                return None
+            entry['used'] = time.time()
+            return entry['id']
+
+    def set_remote_id(self, project_id, digest, dataset_id):
+        with self.lock:
+            remote = self.index['remote']
+            remote[project_id + ":" + digest] = {'id': dataset_id, 'used': time.time()}
+            for key in sorted(remote, key=lambda k: remote[k]['used'])[0:max(0, len(remote) - self.max_remote)]:
+                del remote[key]
+            self.save_index()
+
+    def forget_remote_id(self, project_id, digest):
+        # FOR A PREDICTION DATASET DATAROBOT NO LONGER HAS (EXPIRED OR DELETED)
+        with self.lock:
+            if self.index['remote'].pop(project_id + ":" + digest, None) is not None:
+                self.save_index()
+
+    def evict(self):
+        files = self.index['files']
+        used = sum(entry['bytes'] for entry in files.values())
+        for digest in sorted(files, key=lambda d: files[d]['used']):
+            if used <= self.max_bytes or len(files) == 1:
+                break
+            entry = files.pop(digest)
+            used = used - entry['bytes']
+            for part in entry['parts']:
+                path = os.path.join(self.folder, part)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def stats(self):
+        with self.lock:
+            files = self.index['files']
+            return {'files': len(files), 'bytes': sum(entry['bytes'] for entry in files.values()),
+                    'max_bytes': self.max_bytes, 'remote_datasets': len(self.index['remote']),
+                    'max_remote_datasets': self.max_remote,
+                    'format': 'feather' if feather is not None else 'pickle'}
+
+
+##################################################################################################################
+# CONTENT DIGESTS OF FILES AND FRAMES
+##################################################################################################################
+def file_digest(filepath, chunk=1 << 20):
+    sha = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def frame_digest(pdata):
+    hashed = pd.util.hash_pandas_object(pdata, index=False).values
+    sha = hashlib.sha1("|".join(str(c) for c in pdata.columns).encode('utf-8'))
+    sha.update(hashed.tobytes())
+    return sha.hexdigest()
+
+
+store = DatasetStore(Config.DATASET_FOLDER, Config.DATASET_MAX_BYTES, Config.DATASET_MAX_REMOTE,
+                     Config.DATASET_CHUNK_ROWS)
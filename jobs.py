@@ -0,0 +1,90 @@
+# ##############################################################################################################
+# BACKGROUND JOBS
+#
+# Long running analyses (the optimisations) are submitted to a worker pool and return a job id straight
+# away. The work function is handed a progress callback that records the current phase and the percent
+# complete, which the status endpoint reports. A submission whose key matches a job that is still pending
+# or running is attached to that job instead of starting another one.
+# ##############################################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+import uuid
+import time
+
+from config import Config
+
+log = logging.getLogger(__name__)
+
+
+class Job(object):
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'pending'
+        self.phase = 'queued'
+        self.percent = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.args = ()
+
+    def progress(self, phase, percent):
+        self.phase = phase
+        self.percent = int(min(100, max(0, percent)))
+
+    def to_dict(self):
+        return {'id': self.id, 'status': self.status, 'phase': self.phase,
+                'percent': self.percent, 'error': self.error}
+
+
+class JobRunner(object):
+
+    def __init__(self, max_workers, keep_seconds=3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.keep_seconds = keep_seconds
+        self.jobs = {}
+        self.active = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self.lock:
+            self.expire()
+            if key in self.active:
+                return self.active[key]
+            job = Job(key)
+            job.args = args
+            self.jobs[job.id] = job
+            self.active[key] = job
+        self.executor.submit(self.run, job, fn, args, kwargs)
+        return job
+
+    def run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        try:
+            job.result = fn(*args, progress=job.progress, **kwargs)
+            job.status = 'done'
+            job.progress('finished', 100)
+        except Exception as e:
+            log.exception("Job %s failed", job.id)
+            job.status = 'failed'
+            job.error = str(e)
+        job.finished = time.time()
+        with self.lock:
+            if self.active.get(job.key) is job:
+                del self.active[job.key]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def expire(self):
+        now = time.time()
+        for job_id in [j.id for j in self.jobs.values() if j.finished and now - j.finished > self.keep_seconds]:
+            del self.jobs[job_id]
+
+
+runner = JobRunner(Config.JOB_WORKERS)
@@ -0,0 +1,152 @@
+# ##############################################################################################################
+# INSTRUMENTATION
+#
+# A small in-process registry of counters, gauges and histograms, rendered in the Prometheus text format
+# on /metrics. Timings are also written to the 'metrics' logger as key=value records, e.g.
+#
+#    timing metric=datarobot_call_seconds call=get_roc_curve seconds=0.412
+#
+# The app records per-route latencies; cache.py and scoring.py record every remote DataRobot call by type;
+# opti.py records the phases of an optimisation; scoring.py keeps the rows scored per second.
+# ##############################################################################################################
+
+from contextlib import contextmanager
+import threading
+import logging
+import time
+
+log = logging.getLogger('metrics')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class Metric(object):
+
+    def __init__(self, name, help, kind):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render_labels(self, labels, extra=None):
+        pairs = list(labels) + ([extra] if extra else [])
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in pairs) + "}"
+
+
+class Counter(Metric):
+
+    def __init__(self, name, help):
+        Metric.__init__(self, name, help, 'counter')
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            return ["%s%s %s" % (self.name, self.render_labels(k), v) for k, v in self.values.items()]
+
+
+class Gauge(Metric):
+
+    def __init__(self, name, help):
+        Metric.__init__(self, name, help, 'gauge')
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        with self.lock:
+            return ["%s%s %s" % (self.name, self.render_labels(k), v) for k, v in self.values.items()]
+
+
+class Histogram(Metric):
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        Metric.__init__(self, name, help, 'histogram')
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (1 if value <= b else 0) for c, b in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, c in zip(self.buckets, counts):
+                    lines.append("%s_bucket%s %s" % (self.name, self.render_labels(key, ('le', bound)), c))
+                lines.append("%s_bucket%s %s" % (self.name, self.render_labels(key, ('le', '+Inf')), count))
+                lines.append("%s_sum%s %s" % (self.name, self.render_labels(key), total))
+                lines.append("%s_count%s %s" % (self.name, self.render_labels(key), count))
+        return lines
+
+
+route_seconds = Histogram('http_request_duration_seconds', "Latency of each Flask route")
+route_requests = Counter('http_requests_total', "Requests served by route, method and status")
+remote_seconds = Histogram('datarobot_call_seconds', "Latency of remote DataRobot calls by call type")
+remote_calls = Counter('datarobot_calls_total', "Remote DataRobot calls by call type")
+remote_errors = Counter('datarobot_call_errors_total', "Remote DataRobot calls that raised, by call type")
+phase_seconds = Histogram('optimization_phase_seconds', "Time spent in each phase of an optimization")
+rows_scored = Counter('rows_scored_total', "Rows sent to a scoring backend")
+rows_per_second = Gauge('rows_scored_per_second', "Scoring throughput of the most recent batch")
+
+REGISTRY = [route_seconds, route_requests, remote_seconds, remote_calls, remote_errors,
+            phase_seconds, rows_scored, rows_per_second]
+
+
+def timing(metric, seconds, **labels):
+    log.info("timing metric=%s %s seconds=%.4f", metric.name,
+             " ".join("%s=%s" % (k, v) for k, v in sorted(labels.items())), seconds)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        histogram.observe(seconds, **labels)
+        timing(histogram, seconds, **labels)
+
+
+##################################################################################################################
+# TIME A REMOTE DATAROBOT CALL
+##################################################################################################################
+@contextmanager
+def remote_call(call):
+    remote_calls.inc(call=call)
+    try:
+        with timed(remote_seconds, call=call):
+            yield
+    except Exception:
+        remote_errors.inc(call=call)
+        raise
+
+
+def phase(name):
+    return timed(phase_seconds, phase=name)
+
+
+def record_scored(rows, seconds):
+    rows_scored.inc(rows)
+    if seconds > 0:
+        rows_per_second.set(rows / seconds)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append("# HELP %s %s" % (metric.name, metric.help))
+        lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
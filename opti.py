@@ -11,17 +11,22 @@
 #       that the causality holds and the model approximates this relationship.
 # ##############################################################################################################
 
-import datarobot as dr
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict, namedtuple
+import multiprocessing
+import threading
 import numpy as np
 import pandas as pd
+import logging
+import metrics
+import scoring
+
+log = logging.getLogger(__name__)
 
 def get_midpoints_of_binned_intervals(pdata, colname):
-    intervals = pdata[colname].value_counts(bins=30).index.tolist()
-    mydist = pdata[colname].value_counts(bins=30).tolist()
-    def interval_midpoint(x): 
-        return (x.left + (x.right-x.left)/2)
-    midpoints = [ interval_midpoint(i) for i in intervals]
-    return midpoints, mydist
+    counts = pdata[colname].value_counts(bins=30, sort=False)
+    midpoints = [ i.left + (i.right-i.left)/2 for i in counts.index]
+    return midpoints, counts.tolist()
 
 
 ##################################################################################################################
@@ -30,84 +35,167 @@ def get_midpoints_of_binned_intervals(pdata, colname):
 # TODO : TEST SOME VARIATIONS ON THIS 
 ##################################################################################################################
 def get_val_list_to_simulate(pdata, colname):
-    colvals = pdata[colname].unique()
-    if len(colvals)<31:
-        myvals = pdata[colname].value_counts()
-        valdist = np.array((myvals).tolist())
-        return colvals, valdist
+    profile = profile_feature(pdata, colname)
+    return profile.values, profile.dist
+
+
+##################################################################################################################
+# FEATURE PROFILES
+# THE CANDIDATE VALUES OF A COLUMN, THEIR OBSERVED COUNTS AND (FOR BINNED NUMERIC COLUMNS) THE BIN EDGES,
+# COMPUTED WITH A SINGLE value_counts AND CACHED PER DATASET AND COLUMN. THE COUNTS ARE THE HISTOGRAM
+# THE KL DIVERGENCE IN calculate_feature_distribution_change IS MEASURED AGAINST.
+##################################################################################################################
+FeatureProfile = namedtuple('FeatureProfile', ['values', 'dist', 'edges'])
+
+PROFILE_CACHE_SIZE = 256
+profile_cache = OrderedDict()
+profile_lock = threading.Lock()
+
+def dataset_key(pdata):
+    return (len(pdata), int(pd.util.hash_pandas_object(pdata, index=False).sum()))
+
+
+def profile_feature(pdata, colname, key=None):
+    if key is None:
+        key = dataset_key(pdata[[colname]])
+    with profile_lock:
+        if (key, colname) in profile_cache:
+            profile_cache.move_to_end((key, colname))
+            return profile_cache[(key, colname)]
+
+    column = pdata[colname]
+    counts = column.value_counts(dropna=False)
+    if len(counts) < 31:
+        profile = FeatureProfile(counts.index.values, counts.values, None)
+    elif pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column) \
+         and counts.iloc[0] <= (0.1*len(pdata)):
+        # NO SMALL SET OF VALUES DOMINATES - SIMULATE THE MIDPOINTS OF 30 BINS
+        binned = column.value_counts(bins=30, sort=False)
+        edges = np.array([binned.index[0].left] + [i.right for i in binned.index])
+        midpoints = (edges[:-1] + edges[1:]) / 2
+        profile = FeatureProfile(midpoints, binned.values, edges)
     else:
-      myvals = pdata[colname].value_counts().index.tolist()[0:30]
-      mydist = pdata[colname].value_counts().tolist()[0:30]
-      if(pdata[colname].dtype == np.float64 or pdata[colname].dtype == np.int64):
-          # CRUDE CHECK TO SEE IF THE DISTRIBUTION IS SKEWED TOWARDS A FEW VALUES
-          if mydist[0] > (0.1*len(pdata)):
-              return myvals, mydist
-          else:
-              myvals, mydist = get_midpoints_of_binned_intervals(pdata, colname)
-              return myvals, mydist
-      else: 
-          return myvals, mydist
+        # CRUDE CHECK SAYS THE DISTRIBUTION IS SKEWED TOWARDS A FEW VALUES (OR IS NOT NUMERIC)
+        profile = FeatureProfile(counts.index.values[0:30], counts.values[0:30], None)
+
+    with profile_lock:
+        profile_cache[(key, colname)] = profile
+        while len(profile_cache) > PROFILE_CACHE_SIZE:
+            profile_cache.popitem(last=False)
+    return profile
 
 
 ##################################################################################################################
 # GET SIMULATED DATA
 ##################################################################################################################
 def get_simulated_data(pdata, colone, colone_values, coltwo, coltwo_values):
-    new_data = []
-    for c1_value in colone_values:
-        for c2_value in coltwo_values:
-            temp_data = pdata.copy()
-            temp_data[colone] = c1_value
-            temp_data[coltwo] = c2_value
-            new_data.append(temp_data)
-    return pd.concat(new_data)
-
-def sample_down(pdata):
-    if len(pdata) < 1000 :
+    return pd.concat(list(iter_simulated_data(pdata, colone, colone_values, coltwo, coltwo_values)))
+
+
+##################################################################################################################
+# GENERATE THE SIMULATED DATA LAZILY
+# YIELDS BLOCKS OF WHOLE (c1, c2) COMBINATIONS IN THE SAME GRID ORDER AS get_simulated_data, EACH BLOCK
+# HOLDING AT MOST block_rows ROWS (OR ONE COMBINATION IF THE SAMPLE IS LARGER THAN THAT). THE UNTOUCHED
+# COLUMNS ARE TAKEN ONCE PER BLOCK WITH A TILED ROW INDEX INSTEAD OF ONE COPY PER COMBINATION.
+##################################################################################################################
+SIM_BLOCK_ROWS = 100000
+
+def iter_simulated_data(pdata, colone, colone_values, coltwo, coltwo_values, block_rows=SIM_BLOCK_ROWS):
+    return iter_grid_data(pdata, [colone, coltwo], [colone_values, coltwo_values], block_rows)
+
+
+##################################################################################################################
+# THE SAME FOR ANY NUMBER OF COLUMNS - COMBINATIONS ARE ENUMERATED IN C ORDER OVER THE VALUE LISTS
+##################################################################################################################
+def iter_grid_data(pdata, columns, values, block_rows=SIM_BLOCK_ROWS):
+    records = len(pdata)
+    values = [pd.Series(list(v)).values for v in values]
+    shape = [len(v) for v in values]
+    combinations = int(np.prod(shape))
+    per_block = max(1, int(block_rows / max(records, 1)))
+    for start in range(0, combinations, per_block):
+        combos = np.arange(start, min(start + per_block, combinations))
+        positions = np.unravel_index(combos, shape)
+        block = pdata.iloc[np.tile(np.arange(records), len(combos))].reset_index(drop=True)
+        for col, vals, pos in zip(columns, values, positions):
+            block[col] = np.repeat(vals[pos], records)
+        yield block
+
+
+SAMPLE_SIZE = 1000
+
+def sample_down(pdata, sample_size=SAMPLE_SIZE, seed=None):
+    if len(pdata) <= sample_size :
         return pdata
-    rez = pdata.sample(1000).copy()
+    rez = pdata.sample(sample_size, random_state=seed).copy()
     return rez.reset_index()
 
 
 ##################################################################################################################
-# RUN BRUTE FORCE
+# STREAMING SAMPLE
+# KEEPS A UNIFORM RANDOM SAMPLE OF sample_size ROWS FROM A SEQUENCE OF CHUNKS (OF A CSV FILE, OR OF A STORED
+# UPLOAD - SEE datasets.DatasetStore.chunks) WITH A RESERVOIR SAMPLER, SO MEMORY IS BOUNDED BY THE SAMPLE
+# SIZE AND ONE CHUNK, NOT THE FILE SIZE. RETURNS THE SAMPLE AND THE TOTAL NUMBER OF ROWS SEEN.
+##################################################################################################################
+def sample_chunks(chunks, sample_size=SAMPLE_SIZE, seed=None):
+    rng = np.random.default_rng(seed)
+    reservoir = None
+    seen = 0
+    for chunk in chunks:
+        chunk = chunk.reset_index(drop=True)
+        filled = 0 if reservoir is None else len(reservoir)
+        take = min(sample_size - filled, len(chunk))
+        if take > 0 or reservoir is None:
+            first = chunk.iloc[0:take].copy()
+            first.index = np.arange(filled, filled + take)
+            reservoir = first if reservoir is None else pd.concat([reservoir, first])
+        # EVERY LATER ROW t REPLACES A RANDOM SLOT WITH PROBABILITY sample_size / (t + 1)
+        positions = np.arange(take, len(chunk))
+        slots = rng.integers(0, seen + positions + 1)
+        accept = slots < sample_size
+        if accept.any():
+            replace = pd.DataFrame({'slot': slots[accept], 'row': positions[accept]})
+            replace = replace.drop_duplicates('slot', keep='last')
+            new_rows = chunk.iloc[replace['row'].values].copy()
+            new_rows.index = replace['slot'].values
+            reservoir = pd.concat([reservoir.drop(index=new_rows.index), new_rows]).sort_index()
+        seen = seen + len(chunk)
+    if reservoir is not None:
+        reservoir = reservoir.reset_index(drop=True)
+    return reservoir, seen
+
+
+def sample_csv(filepath, columns=None, sample_size=SAMPLE_SIZE, seed=None, chunksize=100000):
+    # ONLY THE GIVEN COLUMNS ARE PARSED
+    usecols = None
+    if columns is not None:
+        wanted = set(columns)
+        usecols = lambda c: c in wanted
+    reservoir, seen = sample_chunks(pd.read_csv(filepath, usecols=usecols, chunksize=chunksize), sample_size, seed)
+    if reservoir is None:
+        reservoir = pd.read_csv(filepath, usecols=usecols, nrows=0)
+    return reservoir, seen
+
+
+##################################################################################################################
+# CALIBRATION
+# Separate the data into two sets and create an out-of-sample calibration factor for the expected outcome.
+# This analysis will depend to a large extent on how well we can estimate a change in the expected number
+# of a given outcome, which requires a well calibrated model
 ##################################################################################################################
-def run_brute_force(project, model, df, colone, coltwo):
-    # Separate the data into two sets for 
-    # a potential calibration step.
-    print("Total records %i" % len(df))
-    pdata = sample_down(df)
-    print("Sampled records %i" % len(pdata))
-    positive_class = project.positive_class
-    target = project.target
+def calibrate(pdata, preds, target, positive_class):
     midpoint = int(len(pdata)/2)
-    print("Midpoint %i" % midpoint)
+    log.info("Midpoint %i", midpoint)
     pdata1 = pdata.loc[0:midpoint]
     pdata2 = pdata.loc[midpoint+1:]
     actuals1 = sum(pdata1[target] == positive_class)
     actuals2 = sum(pdata2[target] == positive_class)
 
-    col1vals, col1dist = get_val_list_to_simulate(pdata, colone)
-    col2vals, col2dist = get_val_list_to_simulate(pdata, coltwo)
-
-    print("Col 1 contains %i Unique Values: " % len(col1vals) )
-    print("Distribution", col1dist)
-    print("Col 2 contains %i Unique Values: " % len(col2vals) )
-    print("Distribution", col2dist)
-
-    # Score the entire dataset as it is, then split (order is preserved)
-    preds = get_scores(project, model, pdata)
     preds1 = preds.loc[0:midpoint] 
     preds2 = preds.loc[midpoint+1:]
     expected1 = sum(preds1['positive_probability'])
     expected2 = sum(preds2['positive_probability'])
 
-    # #############################################################################################
-    # Create an out-of-sample calibration factor for the expected outcome.
-    # This analysis will depend to a large extent on how well we can estimate
-    # a change in the expected number of a given outcome, which requires a
-    # well calibrated model
-    # #############################################################################################
     adjustment2 = ( actuals1 - expected1 ) / expected1
     adjustment1 = ( actuals2 - expected2 ) / expected2
     adjusted1 = expected1 + ( expected1 * adjustment1)
@@ -117,110 +205,437 @@ def run_brute_force(project, model, df, colone, coltwo):
     raw_exp_err2 = round( 100 *(expected2 - actuals2) / actuals2,1)
     adj_exp_err1 = round( 100 *(adjusted1 - actuals1) / actuals1,1)
     adj_exp_err2 = round( 100 *(adjusted2 - actuals2) / actuals2,1)
-    raw_lb = min(raw_exp_err1, raw_exp_err2)
-    raw_ub = max(raw_exp_err1, raw_exp_err2)
-    adj_lb = min(adj_exp_err1, adj_exp_err2)
-    adj_ub = max(adj_exp_err1, adj_exp_err2)
  
-    print("Subset 1. RAW ERROR  %f ADJUSTED: %f " % (raw_exp_err1, adj_exp_err1) )
-    print("Subset 2. RAW ERROR  %f ADJUSTED: %f " % (raw_exp_err2, adj_exp_err2) )
+    log.info("Subset 1. RAW ERROR  %f ADJUSTED: %f ", raw_exp_err1, adj_exp_err1)
+    log.info("Subset 2. RAW ERROR  %f ADJUSTED: %f ", raw_exp_err2, adj_exp_err2)
 
     total = actuals1+actuals2
     raw_expected = round(expected1+expected2,1)
     adj_expected = round(adjusted1+adjusted2,1)
 
-    print("Total. Actuals: %f Predicted: %f Adjusted: %f " % (total, raw_expected, adj_expected) )
+    log.info("Total. Actuals: %f Predicted: %f Adjusted: %f ", total, raw_expected, adj_expected)
+    return total, adjustment1, adjustment2
+
+
+##################################################################################################################
+# RATHER THAN RETURN THE OPTIMISED SUM DIRECTLY WE USE THE OBSERVED ERROR IN PREDICTING THE TARGET FROM OUR 
+# TWO OUT_OF_SAMPLE SETS, TO CREATE A LOWER AND UPPER ADJUSTED ESTIMATE OF THE OPTIMISED TARGET BASED ON THE
+# CHANGED INPUTS.
+# NOTE: THIS IS STILL VERY CRUDE. IT WOULD BE BETTER IF THE ERROR ESTIMATE WAS SENSITIVE TO THE
+#       INPUT FEATURES, SO WE KNEW IF WE HAD OPTIMISED TO A POORLY REPRESENTED REGION IN THE 
+#       FEATURE SPACE.
+##################################################################################################################
+def adjusted_bounds(tempsum, adjustment1, adjustment2):
+    adj_exp_1 = tempsum + ( tempsum * adjustment1)
+    adj_exp_2 = tempsum + ( tempsum * adjustment2)
+    return min(adj_exp_1, adj_exp_2), max(adj_exp_1, adj_exp_2)
+
+
+##################################################################################################################
+# BOUNDS FROM THE FIXED SPLIT, OR (IF resampling IS 'bootstrap' OR 'kfold') FROM RESAMPLED ADJUSTMENTS
+##################################################################################################################
+def calibrated_bounds(tempsum, pdata, preds, project, adjustment1, adjustment2, resampling, resamples, processes):
+    if resampling is None:
+        return adjusted_bounds(tempsum, adjustment1, adjustment2)
+    with metrics.phase('calibration resampling'):
+        actual = (pdata[project.target] == project.positive_class).values
+        adjustments = calibration_adjustments(actual, preds['positive_probability'].values,
+                                              resampling, resamples, processes=processes)
+    return resampled_bounds(tempsum, adjustments)
+
+
+##################################################################################################################
+# RESAMPLED CALIBRATION
+# INSTEAD OF ONE FIXED SPLIT AT THE MIDPOINT, COMPUTE THE CALIBRATION ADJUSTMENT ( actual - expected ) / expected
+# OVER MANY BOOTSTRAP RESAMPLES OR K-FOLD SPLITS OF THE BASELINE PREDICTIONS WE ALREADY HAVE, SO NO EXTRA
+# SCORING IS NEEDED. THE BOUNDS ON THE OPTIMISED TARGET ARE THEN THE PERCENTILES OF THE ADJUSTED ESTIMATES.
+# THE RESAMPLES ARE DRAWN IN FIXED CHUNKS OF RESAMPLE_CHUNK, EACH WITH ITS OWN SEED, SO THE RESULT IS THE SAME
+# HOWEVER MANY PROCESSES SHARE THEM. BY DEFAULT THEY ARE VECTORIZED IN THIS PROCESS; WITH processes > 1 THE
+# CHUNKS GO TO SPAWNED (NOT FORKED) PROCESSES, AS FORKING THE MULTI-THREADED SERVER CAN DEADLOCK THE CHILD.
+##################################################################################################################
+RESAMPLES = 200
+RESAMPLE_CHUNK = 50
+FOLDS = 5
+
+def calibration_adjustments(actual, expected, method='bootstrap', resamples=RESAMPLES, seed=0, processes=1):
+    actual = np.asarray(actual, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    chunks = [RESAMPLE_CHUNK] * (resamples // RESAMPLE_CHUNK)
+    if resamples % RESAMPLE_CHUNK > 0:
+        chunks.append(resamples % RESAMPLE_CHUNK)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(actual, expected, method, n, s) for n, s in zip(chunks, seeds)]
+    if processes <= 1 or len(tasks) <= 1:
+        results = [resample_adjustments(t) for t in tasks]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)), mp_context=context) as executor:
+            results = list(executor.map(resample_adjustments, tasks))
+    return np.concatenate(results)
+
+
+def resample_adjustments(task):
+    actual, expected, method, resamples, seed = task
+    rng = np.random.default_rng(seed)
+    rows = len(actual)
+    if method == 'kfold':
+        # EACH REPEAT SHUFFLES THE ROWS INTO FOLDS AND MEASURES THE ADJUSTMENT ON EVERY FOLD
+        repeats = int(np.ceil(resamples / float(FOLDS)))
+        folds = np.concatenate([rng.permutation(rows) % FOLDS for i in range(repeats)]).reshape(repeats, rows)
+        act = np.stack([np.bincount(f, weights=actual, minlength=FOLDS) for f in folds]).ravel()
+        exp = np.stack([np.bincount(f, weights=expected, minlength=FOLDS) for f in folds]).ravel()
+        act, exp = act[0:resamples], exp[0:resamples]
+    else:
+        picks = rng.integers(0, rows, size=(resamples, rows))
+        act = actual[picks].sum(axis=1)
+        exp = expected[picks].sum(axis=1)
+    return (act - exp) / exp
+
+
+def resampled_bounds(tempsum, adjustments, confidence=0.9):
+    estimates = tempsum + ( tempsum * adjustments )
+    tail = 100 * (1 - confidence) / 2
+    return np.percentile(estimates, tail), np.percentile(estimates, 100 - tail)
+
+
+##################################################################################################################
+# RUN BRUTE FORCE
+##################################################################################################################
+def run_brute_force(project, model, df, colone, coltwo, scorer=None, progress=None, sample_size=SAMPLE_SIZE,
+                    resampling=None, resamples=RESAMPLES, processes=1):
+    report_progress(progress, 'sampling', 0)
+    with metrics.phase('sampling'):
+        log.info("Total records %i", len(df))
+        pdata = sample_down(df, sample_size)
+        log.info("Sampled records %i", len(pdata))
+
+        key = dataset_key(pdata)
+        profile1 = profile_feature(pdata, colone, key)
+        profile2 = profile_feature(pdata, coltwo, key)
+        col1vals, col1dist = profile1.values, profile1.dist
+        col2vals, col2dist = profile2.values, profile2.dist
+
+    log.info("Col 1 contains %i Unique Values. Distribution %s", len(col1vals), col1dist)
+    log.info("Col 2 contains %i Unique Values. Distribution %s", len(col2vals), col2dist)
+
+    # Score the entire dataset as it is, then split (order is preserved)
+    report_progress(progress, 'baseline scoring', 5)
+    if scorer is None:
+        scorer = scoring.DataRobotScorer(project, model)
+    scorer = scoring.cached(scorer)
+    with metrics.phase('baseline scoring'):
+        preds = get_scores(project, model, pdata, scorer)
+    total, adjustment1, adjustment2 = calibrate(pdata, preds, project.target, project.positive_class)
 
     # ##############################################################################################
     # NOW GENERATE A DATASET THAT CONTAINS A LARGE NUMBER OF COMBINATIONS OF THE
     # TWO COLUMNS WE ARE ATTEMPTING TO OPTOMISE OVER. 
+    # THE PERMUTATIONS ARE GENERATED AND SCORED BLOCK BY BLOCK SO THAT MEMORY STAYS FLAT
     # ##############################################################################################
-    sim_data = get_simulated_data(pdata, colone, col1vals, coltwo, col2vals)
+    records = len(pdata)
+    permutations = records * len(col1vals) * len(col2vals)
+    log.info("Optimising %i Records. Scoring %i Permutations", records, permutations)
+
+    report_progress(progress, 'permutation scoring', 10)
+    scores = []
+    scored_rows = 0
+    with metrics.phase('permutation scoring'):
+        sim_blocks = iter_simulated_data(pdata, colone, col1vals, coltwo, col2vals)
+        for scored_block in scoring.score_stream(scorer, sim_blocks):
+            scores.append(scored_block['positive_probability'].values)
+            scored_rows = scored_rows + len(scored_block)
+            report_progress(progress, 'permutation scoring', 10 + 80 * scored_rows / permutations)
+
+    # NOW DETERMINE FOR EACH OF THE ORIGINAL ROWS WHICH COMBINATION MAXIMISED THE PREDICTED TARGET
+    report_progress(progress, 'aggregation', 90)
+    with metrics.phase('aggregation'):
+        maxvals, onevals, twovals = get_optimal_combinations(np.concatenate(scores), records, col1vals, col2vals)
+        tempsum = maxvals.sum()
+
+    with metrics.phase('kl'):
+        f1d = add_pseudo_counts(calculate_feature_distribution(col1vals, onevals, profile1.edges))
+        f2d = add_pseudo_counts(calculate_feature_distribution(col2vals, twovals, profile2.edges))
+        f1c = calculate_feature_distribution_change(col1dist, f1d)
+        f2c = calculate_feature_distribution_change(col2dist, f2d)
+
+    lb, ub = calibrated_bounds(tempsum, pdata, preds, project, adjustment1, adjustment2,
+                               resampling, resamples, processes)
+    return total, lb, ub, f1c, f2c
+
 
+##################################################################################################################
+# RUN THE BRUTE FORCE SEARCH FOR SEVERAL MODELS OF A PROJECT
+# THE SAMPLE AND THE CANDIDATE VALUES (VIA THE PROFILE CACHE) ARE COMPUTED ONCE AND SHARED, AND THE MODELS
+# ARE SCORED CONCURRENTLY. RETURNS ONE RESULT PER MODEL, IN THE ORDER GIVEN, WITH THE SAME FIGURES AS
+# run_brute_force. PROGRESS IS REPORTED AS THE AVERAGE OVER THE MODELS.
+##################################################################################################################
+def compare_brute_force(project, models, df, colone, coltwo, scorer=None, progress=None, sample_size=SAMPLE_SIZE,
+                        max_workers=4, **bounds):
+    report_progress(progress, 'sampling', 0)
+    with metrics.phase('sampling'):
+        pdata = sample_down(df, sample_size)
+        key = dataset_key(pdata)
+        profile_feature(pdata, colone, key)
+        profile_feature(pdata, coltwo, key)
+
+    done = [0.0] * len(models)
+    def model_progress(index):
+        def update(phase, percent):
+            done[index] = percent
+            report_progress(progress, phase, sum(done) / len(done))
+        return update
+
+    def run(index):
+        return run_brute_force(project, models[index], pdata, colone, coltwo, scorer=scorer,
+                               progress=model_progress(index), sample_size=sample_size, **bounds)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(models)))) as executor:
+        results = list(executor.map(run, range(len(models))))
+    return [dict(model=m, total=r[0], optimised_lb=r[1], optimised_ub=r[2], feat1_change=r[3], feat2_change=r[4])
+            for m, r in zip(models, results)]
+
+
+##################################################################################################################
+# RUN BRUTE FORCE WITH PROGRESSIVE SAMPLING
+# INSTEAD OF SCORING A FIXED SAMPLE, SCORE THE SEARCH IN BATCHES OF ROWS THAT GROW WITH THE ROWS ALREADY USED
+# (batch_rows, batch_rows, 2 * batch_rows, ...) AND AFTER EACH BATCH BOOTSTRAP THE ROWS SO FAR FOR AN
+# INTERVAL ON THE OPTIMISED TARGET, RESAMPLING THE OPTIMISED PROBABILITIES AND THE CALIBRATION ADJUSTMENT
+# TOGETHER. WE STOP WHEN THE INTERVAL IS NARROWER THAN max_width_pct OF ITS MIDPOINT, WHEN THE NEXT BATCH
+# WOULD TAKE THE SCORING CALLS PAST call_budget, OR WHEN THE SAMPLE IS USED UP.
+#
+# THE ESTIMATES ARE SCALED TO THE WHOLE SAMPLE SO THEY COMPARE WITH total (THE OBSERVED TARGET, WHICH NEEDS
+# NO SCORING) AND WITH THE OUTPUT OF run_brute_force. THE REPORT HAS THE ROWS AND SCORING CALLS USED.
+##################################################################################################################
+PROGRESSIVE_BATCH_ROWS = 100
+PROGRESSIVE_MAX_WIDTH_PCT = 10.0
+
+def run_progressive_brute_force(project, model, df, colone, coltwo, scorer=None, progress=None,
+                                sample_size=SAMPLE_SIZE, batch_rows=PROGRESSIVE_BATCH_ROWS,
+                                max_width_pct=PROGRESSIVE_MAX_WIDTH_PCT, call_budget=None,
+                                resamples=RESAMPLES, confidence=0.9, seed=0):
+    report_progress(progress, 'sampling', 0)
+    with metrics.phase('sampling'):
+        pdata = sample_down(df, sample_size)
+        pdata = pdata.sample(frac=1, random_state=seed).reset_index(drop=True)
+        key = dataset_key(pdata)
+        profile1 = profile_feature(pdata, colone, key)
+        profile2 = profile_feature(pdata, coltwo, key)
+        col1vals, col2vals = profile1.values, profile2.values
     records = len(pdata)
-    print("Optimising %i Records" % (len(pdata)) )
-    print("Scoring %i Permutations" % (len(sim_data)) )
+    total = int((pdata[project.target] == project.positive_class).sum())
+    per_row = 1 + len(col1vals) * len(col2vals)
+
+    if scorer is None:
+        scorer = scoring.DataRobotScorer(project, model)
+    scorer = scoring.cached(scorer)
+    rng = np.random.default_rng(seed)
+
+    actual, expected, maxvals, onevals, twovals = [], [], [], [], []
+    used = 0
+    calls = 0
+    lb, ub, width = 0.0, 0.0, None
+    stopped = 'sample exhausted'
+    while used < records:
+        rows = min(max(batch_rows, used), records - used)
+        if call_budget is not None and calls + rows * per_row > call_budget:
+            rows = int((call_budget - calls) / per_row)
+            if rows <= 0:
+                stopped = 'call budget'
+                break
+        batch = pdata.iloc[used:used + rows].reset_index(drop=True)
+        report_progress(progress, 'progressive scoring', 5 + 90 * used / records)
+        with metrics.phase('baseline scoring'):
+            preds = get_scores(project, model, batch, scorer)
+        scores = []
+        with metrics.phase('permutation scoring'):
+            for scored_block in scoring.score_stream(scorer, iter_simulated_data(batch, colone, col1vals,
+                                                                                 coltwo, col2vals)):
+                scores.append(scored_block['positive_probability'].values)
+        with metrics.phase('aggregation'):
+            best, ones, twos = get_optimal_combinations(np.concatenate(scores), rows, col1vals, col2vals)
+        actual.append((batch[project.target] == project.positive_class).values)
+        expected.append(preds['positive_probability'].values)
+        maxvals.append(best)
+        onevals.extend(ones)
+        twovals.extend(twos)
+        used = used + rows
+        calls = calls + rows * per_row
+
+        lb, ub = bootstrap_bounds(np.concatenate(maxvals), np.concatenate(actual), np.concatenate(expected),
+                                  records, rng, resamples, confidence)
+        width = 100 * (ub - lb) / max(abs(ub + lb) / 2, 1e-12)
+        log.info("Progressive sampling: %i rows, %i calls, bounds %f - %f (%0.1f%%)", used, calls, lb, ub, width)
+        if width <= max_width_pct:
+            stopped = 'interval width'
+            break
+
+    with metrics.phase('kl'):
+        f1d = add_pseudo_counts(calculate_feature_distribution(col1vals, onevals, profile1.edges))
+        f2d = add_pseudo_counts(calculate_feature_distribution(col2vals, twovals, profile2.edges))
+        f1c = calculate_feature_distribution_change(profile1.dist, f1d)
+        f2c = calculate_feature_distribution_change(profile2.dist, f2d)
+
+    report = {'rows': used, 'calls': calls, 'sample_rows': records,
+              'brute_force_calls': records * per_row, 'width_pct': width, 'stopped': stopped}
+    return total, lb, ub, f1c, f2c, report
+
+
+def bootstrap_bounds(maxvals, actual, expected, scale, rng, resamples=RESAMPLES, confidence=0.9):
+    picks = rng.integers(0, len(maxvals), size=(resamples, len(maxvals)))
+    optimised = maxvals[picks].mean(axis=1) * scale
+    exp = expected[picks].sum(axis=1)
+    adjustments = (actual[picks].sum(axis=1) - exp) / exp
+    estimates = optimised + ( optimised * adjustments )
+    tail = 100 * (1 - confidence) / 2
+    return np.percentile(estimates, tail), np.percentile(estimates, 100 - tail)
 
-    scored_data = get_scores(project, model, sim_data)
- 
-    keep_cols = [colone, coltwo, target]
-    justcols = sim_data[keep_cols].copy()
-    justcols = justcols.reset_index(drop=True)
-    scored = scored_data.copy()
-    scored.reset_index(drop=True)
-    to_process = pd.concat([justcols, scored], axis=1)
- 
-    # NOW WE ITERATE OVER EACH OF THE ORIGINAL ROWS 
-    # AND DETERMINE WHICH COMBINATION MAXIMISED THE PREDICTED TARGET
-    # WE USE THE INDEXES TO RETRIEVE ALL COMBINATIONS BUILT OVER EACH
-    # OF THE ORIGINAL RECORDS
-    tempsum = 0
-    onevals = []
-    twovals = []
-    for i in range(records):
-        index_filter = records + 1
-        temp_scores = to_process[(to_process.index == i) | ((to_process.index + 1) % index_filter == 0) ]
-        actualval = preds['positive_probability'].loc[i]
-        maxval, maxone, maxtwo = get_optimal_combination(temp_scores, colone, coltwo, actualval)
-        tempsum = tempsum + maxval
-        onevals.append(maxone)
-        twovals.append(maxtwo)
-
-    f1d = add_pseudo_counts(calculate_feature_distribution(col1vals, onevals))
-    f2d = add_pseudo_counts(calculate_feature_distribution(col2vals, twovals))
- 
-    f1c = calculate_feature_distribution_change(col1dist, f1d)
-    f2c = calculate_feature_distribution_change(col2dist, f2d)
 
-    # ##############################################################################################
-    # RATHER THAN RETURN THIS DIRECTLY WE USE THE OBSERVED ERROR IN PREDICTING THE TARGET FROM OUR 
-    # TWO OUT_OF_SAMPLE SETS ABOVE, TO CREATE A LOWER AND UPPER ADJUSTED ESTIMATE OF THE OPTIMISED
-    # TARGET BASED ON THE CHANGED INPUTS.
-    # NOTE: THIS IS STILL VERY CRUDE. IT WOULD BE BETTER IF THE ERROR ESTIMATE WAS SENSITIVE TO THE
-    #       INPUT FEATURES, SO WE KNEW IF WE HAD OPTIMISED TO A POORLY REPRESENTED REGION IN THE 
-    #       FEATURE SPACE.
-    # TODO: ADD IN A MEASURES OF THE CHANGE IN THE INPUT DISTRIBUTION OF THE OPTIMSED FEATURES
-    # ##############################################################################################
+##################################################################################################################
+# RUN COORDINATE ASCENT
+# AN ALTERNATIVE TO THE BRUTE FORCE SEARCH FOR ANY NUMBER OF COLUMNS. EACH ROW STARTS FROM ITS OBSERVED
+# VALUES; WE THEN TAKE THE COLUMNS ONE AT A TIME AND MOVE EVERY ROW TO THE CANDIDATE VALUE OF THAT COLUMN
+# WITH THE HIGHEST PREDICTED TARGET, HOLDING THE OTHER COLUMNS AT THEIR CURRENT BEST. ROUNDS REPEAT UNTIL
+# NO ROW CHANGES OR max_rounds IS REACHED.
+#
+# EACH ROUND COSTS records * SUM(CANDIDATES) SCORES, AGAINST records * PRODUCT(CANDIDATES) FOR THE FULL
+# GRID. THE RESULT IS A LOCAL OPTIMUM, SO WHEN THE GRID IS SMALL ENOUGH (compare_limit SCORES) WE ALSO
+# RUN THE EXHAUSTIVE SEARCH AND REPORT HOW CLOSE WE GOT.
+##################################################################################################################
+def run_coordinate_ascent(project, model, df, columns, scorer=None, max_rounds=3, compare_limit=0,
+                          progress=None, sample_size=SAMPLE_SIZE, resampling=None, resamples=RESAMPLES,
+                          processes=1):
+    if len(columns) == 0:
+        raise ValueError("Coordinate ascent needs at least one column to optimise")
+    report_progress(progress, 'sampling', 0)
+    log.info("Total records %i", len(df))
+    pdata = sample_down(df, sample_size)
+    records = len(pdata)
+    log.info("Sampled records %i", records)
+
+    key = dataset_key(pdata)
+    profiles = [profile_feature(pdata, col, key) for col in columns]
+    candidates = [profile.values for profile in profiles]
+    for col, colvals in zip(columns, candidates):
+        log.info("Column %s contains %i Candidate Values", col, len(colvals))
+
+    report_progress(progress, 'baseline scoring', 5)
+    if scorer is None:
+        scorer = scoring.DataRobotScorer(project, model)
+    scorer = scoring.cached(scorer)
+    preds = get_scores(project, model, pdata, scorer)
+    total, adjustment1, adjustment2 = calibrate(pdata, preds, project.target, project.positive_class)
+    calls = records
+    steps = max_rounds * len(columns)
+
+    current = pdata.copy()
+    best = preds['positive_probability'].values.copy()
+    for round_number in range(max_rounds):
+        changed = 0
+        for col_number, (col, colvals) in enumerate(zip(columns, candidates)):
+            step = round_number * len(columns) + col_number
+            report_progress(progress, 'permutation scoring', 10 + 70 * step / steps)
+            scores = []
+            sim_blocks = iter_grid_data(current, [col], [colvals])
+            for scored_block in scoring.score_stream(scorer, sim_blocks):
+                scores.append(scored_block['positive_probability'].values)
+            calls = calls + records * len(colvals)
+            maxvals, chosen = get_optimal_grid(np.concatenate(scores), records, [colvals])
+            chosen = pd.Series(chosen[0], index=current.index)
+            changed = changed + int((current[col] != chosen).sum())
+            current[col] = chosen
+            best = maxvals
+        log.info("Round %i changed %i values. Optimised sum %f", round_number + 1, changed, best.sum())
+        if changed == 0:
+            break
+
+    report_progress(progress, 'aggregation', 80)
+    tempsum = best.sum()
+    changes = []
+    for col, profile in zip(columns, profiles):
+        fd = add_pseudo_counts(calculate_feature_distribution(profile.values, current[col].tolist(), profile.edges))
+        changes.append(calculate_feature_distribution_change(profile.dist, fd))
+
+    report = {'calls': calls,
+              'brute_force_calls': records * (1 + int(np.prod([len(v) for v in candidates]))),
+              'optimised': tempsum,
+              'brute_force_optimised': None,
+              'gap_pct': None}
+    if report['brute_force_calls'] <= compare_limit:
+        report_progress(progress, 'brute force comparison', 85)
+        scores = []
+        for scored_block in scoring.score_stream(scorer, iter_grid_data(pdata, columns, candidates)):
+            scores.append(scored_block['positive_probability'].values)
+        maxvals, chosen = get_optimal_grid(np.concatenate(scores), records, candidates)
+        report['brute_force_optimised'] = maxvals.sum()
+        report['gap_pct'] = 100 * (maxvals.sum() - tempsum) / maxvals.sum()
+    log.info("Scoring calls %i (brute force %i)", report['calls'], report['brute_force_calls'])
+
+    lb, ub = calibrated_bounds(tempsum, pdata, preds, project, adjustment1, adjustment2,
+                               resampling, resamples, processes)
+    return total, lb, ub, changes, report
+
+##################################################################################################################
+# PASS THE CURRENT PHASE AND PERCENT COMPLETE TO A PROGRESS CALLBACK (SEE jobs.py)
+##################################################################################################################
+def report_progress(progress, phase, percent):
+    if progress is not None:
+        progress(phase, percent)
 
-    adj_exp_1 = tempsum + ( tempsum * adjustment1)
-    adj_exp_2 = tempsum + ( tempsum * adjustment2)
-    lb = min(adj_exp_1, adj_exp_2)
-    ub = max(adj_exp_1, adj_exp_2)
-    return total, lb, ub, f1c, f2c
 
 ##################################################################################################################
 # CALCULATE THE FEATURE DISTRIBUTION CHANGE - KULLBACK Leibler
 ##################################################################################################################
 def add_pseudo_counts(counts):
-    return list(map(lambda x: x+1, counts))
+    return np.asarray(counts) + 1
 
 
 ##################################################################################################################
 # CALCULATE THE FEATURE DISTRIBUTION CHANGE - KULLBACK Leibler
 ##################################################################################################################
-def calculate_feature_distribution(bins, values):
-    temp = np.zeros(len(bins))
-    mybins = bins.tolist()
-    myvals = values #.tolist()
-    print(mybins)
-    for i in range(len(myvals)):
-        #print("testing for value:", myvals[i])
-        temp[mybins.index(myvals[i])] += 1
-    return temp
+def calculate_feature_distribution(bins, values, edges=None):
+    # COUNT HOW MANY VALUES FALL ON EACH BIN - BY HASH LOOKUP OF THE CANDIDATE VALUES, OR
+    # FOR BINNED NUMERIC COLUMNS BY searchsorted ON THE BIN EDGES
+    if edges is not None:
+        positions = np.searchsorted(edges, np.asarray(values, dtype=float), side='right') - 1
+        positions = np.clip(positions, 0, len(bins) - 1)
+    else:
+        positions = pd.Index(list(bins)).get_indexer(list(values))
+        positions = positions[positions >= 0]
+    return np.bincount(positions, minlength=len(bins)).astype(float)
 
 ##################################################################################################################
 # CALCULATE THE FEATURE DISTRIBUTION CHANGE - TODO
 ##################################################################################################################
 def calculate_feature_distribution_change(original, optimised):
     # INPUT MAY BE COUNT ARRAYS - SO NORMALISE AS PROBABILITY DISTRIBUTIONS
-    act = np.array(original)/sum(original)
-    print("Original Distribution:", act)
-    mod = np.array(optimised)/sum(optimised)
-    print("Optimised Distribution:", mod)
+    act = np.asarray(original, dtype=float)/np.sum(original)
+    mod = np.asarray(optimised, dtype=float)/np.sum(optimised)
     # THEN RETURN KL DIVERGENCE
     return (mod * np.log(mod/act)).sum()
 
 
+##################################################################################################################
+# FIND THE OPTIMAL VALUES FOR EVERY ROW AT ONCE.
+# get_simulated_data (AND iter_grid_data) LAYS THE PERMUTATIONS OUT AS A REGULAR (c1, c2, ..., row) GRID, SO THE SCORES RESHAPE
+# INTO A 3-D ARRAY AND A SINGLE ARGMAX PER ROW FINDS THE BEST COMBINATION. TIES GO TO THE FIRST
+# COMBINATION IN GRID ORDER, AS IN get_optimal_combination.
+##################################################################################################################
+def get_optimal_combinations(scores, records, col1vals, col2vals):
+    maxvals, chosen = get_optimal_grid(scores, records, [col1vals, col2vals])
+    return maxvals, chosen[0], chosen[1]
+
+
+def get_optimal_grid(scores, records, values):
+    shape = [len(v) for v in values]
+    grid = np.asarray(scores, dtype=float).reshape(shape + [records])
+    per_row = np.moveaxis(grid, -1, 0).reshape(records, -1)
+    best = per_row.argmax(axis=1)
+    maxvals = per_row[np.arange(records), best]
+    positions = np.unravel_index(best, shape)
+    chosen = [list(pd.Series(list(v)).values[pos]) for v, pos in zip(values, positions)]
+    return maxvals, chosen
+
+
 ##################################################################################################################
 # FIND THE OPTIMAL VALUES FOR THIS ROW.
 ##################################################################################################################
@@ -254,11 +669,10 @@ def optimise_predicted_output(project, model, colone, col1vals, coltwo, col2vals
 
 ##################################################################################################################
 # GET THE SCORES - 
+# BY DEFAULT FROM THE DATAROBOT MODEL, OR FROM ANY BACKEND IN scoring.py
 ##################################################################################################################
-def get_scores(project, model, pdata):
-    dataset = project.upload_dataset(pdata)
-    pred_job = model.request_predictions(dataset.id)
-    preds = dr.models.predict_job.wait_for_async_predictions(project.id, predict_job_id=pred_job.id, max_wait=600)
-    return preds
-
+def get_scores(project, model, pdata, scorer=None):
+    if scorer is None:
+        scorer = scoring.DataRobotScorer(project, model)
+    return scoring.score_frame(scoring.cached(scorer), pdata)
 
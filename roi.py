@@ -1,19 +1,23 @@
-import datarobot as dr
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import logging
+import cache
 
-def evalBinaryClassModels(project, models, num_models, tp, fp, tn, fn, cases, baserate):
+log = logging.getLogger(__name__)
+
+def evalBinaryClassModels(project, models, num_models, tp, fp, tn, fn, cases, baserate,
+                          max_workers=8, timeout=60, exact=False):
    results = []
    index = 0
+   pointLists = fetchCurves(models[0:num_models], max_workers, timeout, exact)
+   fetched = [i for i in range(len(pointLists)) if pointLists[i] is not None]
+   sweep = sweepOptimalThresholds([pointLists[i] for i in fetched], tp, fp, tn, fn, cases, baserate)
+   position = {i: fetched.index(i) for i in fetched}
    for mod in models:
-      result = {}
-      result['index'] = index
-      result['model_type'] = mod.model_type
-      result['sample_pct'] = mod.sample_pct
-      result['features'] = mod.featurelist_name
-      result['metric'] = mod.metrics[ project.metric ]['validation']
-      if index < num_models: 
-          opti = estimateOptimalThreshold(mod, tp, fp, tn, fn, cases, baserate)
-          result['threshold'] = round(opti['threshold'],3)
-          result['roi'] = round(opti['roi'], 0)
+      result = modelRow(project, mod, index)
+      if index in position:
+          result['threshold'] = round(float(sweep['threshold'][position[index], 0]), 3)
+          result['roi'] = round(float(sweep['roi'][position[index], 0]), 0)
       else:
           result['threshold'] = "?"
           result['roi'] = "?"
@@ -22,22 +26,178 @@ def evalBinaryClassModels(project, models, num_models, tp, fp, tn, fn, cases, ba
    return results
 
 
+# THE LEADERBOARD COLUMNS EVERY ANALYSIS SHOWS FOR A MODEL
+def modelRow(project, mod, index):
+   return {'index': index,
+           'model_type': mod.model_type,
+           'sample_pct': mod.sample_pct,
+           'features': mod.featurelist_name,
+           'metric': mod.metrics[ project.metric ]['validation']}
+
+
+# ##############################################################################################################
+# FETCH THE ROC POINTS OF MANY MODELS CONCURRENTLY
+# Results come back in the order of the models given. A model whose ROC curve cannot be retrieved
+# (an error, or no answer within the timeout) is returned as None rather than failing the whole page.
+# ##############################################################################################################
+def fetchRocPoints(models, max_workers=8, timeout=60, partition='validation'):
+   return fetchConcurrently(cache.get_roc_points, models, max_workers, timeout, partition)
+
+
+# WITH exact THE CURVE OF EVERY DISTINCT THRESHOLD IN THE VALIDATION PREDICTIONS (SEE exactCurve)
+def fetchCurves(models, max_workers=8, timeout=60, exact=False):
+   if exact:
+      return fetchConcurrently(getExactCurve, models, max_workers, timeout)
+   return fetchRocPoints(models, max_workers, timeout)
+
+
+def fetchConcurrently(fetch, models, max_workers, timeout, *args):
+   if len(models) == 0:
+      return []
+   executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(models))))
+   futures = [executor.submit(fetch, mod, *args) for mod in models]
+   # ONE DEADLINE FOR THE WHOLE BATCH, SO HUNG FETCHES DO NOT ADD THEIR WAITS TOGETHER
+   done, pending = wait(futures, timeout=timeout)
+   results = []
+   for future in futures:
+      if future not in done:
+         log.warning("Timed out retrieving %s", fetch.__name__)
+         results.append(None)
+         continue
+      try:
+         results.append(future.result())
+      except Exception as e:
+         log.warning("Failed to retrieve %s: %s", fetch.__name__, e)
+         results.append(None)
+   executor.shutdown(wait=False, cancel_futures=True)
+   return results
+
+
 def estimateOptimalThreshold(mod, tp, fp, tn, fn, cases, baserate):
-   rocCurve = mod.get_roc_curve('validation')
-   points = rocCurve.roc_points
+   points = cache.get_roc_points(mod, 'validation')
+   sweep = sweepOptimalThresholds([points], tp, fp, tn, fn, cases, baserate)
+   return {'threshold': float(sweep['threshold'][0, 0]), 'roi': float(sweep['roi'][0, 0])}
+
+
+# ##############################################################################################################
+# VECTORIZED ROI SWEEP
+#
+# The ROI at a single ROC point is linear in the four rates of that point:
+#
+#    roi = neg*tnr*tn + neg*fpr*fp + pos*tpr*tp + pos*(1-tpr)*fn
+#
+# So we stack the rates of every point of every model into a (models, points, 4) array, the weights of every
+# scenario into a (scenarios, 4) array, and a single matrix product gives the ROI of every model at every
+# threshold under every scenario. Models with fewer ROC points are padded and masked out of the argmax.
+# ##############################################################################################################
+def rocPointArrays(pointLists):
+   columns = [pointColumns(points) for points in pointLists]
+   num_points = max([len(threshold) for threshold, fpr, tpr in columns] + [1])
+   rates = np.zeros((len(pointLists), num_points, 4))
+   thresholds = np.ones((len(pointLists), num_points))
+   valid = np.zeros((len(pointLists), num_points), dtype=bool)
+   for m, (threshold, fpr, tpr) in enumerate(columns):
+      n = len(threshold)
+      rates[m, 0:n, 0] = 1 - fpr
+      rates[m, 0:n, 1] = fpr
+      rates[m, 0:n, 2] = tpr
+      rates[m, 0:n, 3] = 1 - tpr
+      thresholds[m, 0:n] = threshold
+      valid[m, 0:n] = True
+   return rates, thresholds, valid
+
+
+def pointColumns(points):
+   # A LIST OF ROC POINTS, OR AN EXACT CURVE THAT ALREADY HOLDS ONE ARRAY PER COLUMN
+   if isinstance(points, dict):
+      return points['threshold'], points['false_positive_rate'], points['true_positive_rate']
+   return (np.array([point['threshold'] for point in points], dtype=float),
+           np.array([point['false_positive_rate'] for point in points], dtype=float),
+           np.array([point['true_positive_rate'] for point in points], dtype=float))
+
+
+def scenarioWeights(tp, fp, tn, fn, cases, baserate):
+   tp, fp, tn, fn, cases, baserate = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                                           for x in (tp, fp, tn, fn, cases, baserate)])
    pos = cases * baserate
    neg = cases - pos
-   thresh = 1.0
-   roi = -999999
-   for point in points:
-      temp = (neg * point['true_negative_rate'] * tn) +\
-      (neg * point['false_positive_rate'] * fp ) +\
-      (pos * point['true_positive_rate'] * tp ) +\
-      (pos * (1-point['true_positive_rate']) * fn)
-      if temp>roi:
-         roi = temp
-         thresh = point['threshold']
-   return {'threshold': thresh, 'roi': roi}
+   return np.stack([neg * tn, neg * fp, pos * tp, pos * fn], axis=1)
+
+
+SWEEP_CELLS = 1 << 24
+
+def sweepOptimalThresholds(pointLists, tp, fp, tn, fn, cases, baserate):
+   # EACH PAYOFF ARGUMENT MAY BE A SCALAR OR AN ARRAY OF SCENARIOS - THEY ARE BROADCAST TOGETHER
+   # RETURNS (models, scenarios) ARRAYS OF THE OPTIMAL THRESHOLD AND THE ROI ACHIEVED AT IT
+   # SCENARIOS ARE TAKEN IN BATCHES SO THE (models, points, scenarios) PRODUCT HAS AT MOST SWEEP_CELLS CELLS
+   rates, thresholds, valid = rocPointArrays(pointLists)
+   weights = scenarioWeights(tp, fp, tn, fn, cases, baserate)
+   batch_size = max(1, SWEEP_CELLS // max(1, rates.shape[0] * rates.shape[1]))
+   roi = np.zeros((rates.shape[0], len(weights)))
+   threshold = np.zeros((rates.shape[0], len(weights)))
+   for start in range(0, len(weights), batch_size):
+      batch = slice(start, start + batch_size)
+      rois = np.matmul(rates, weights[batch].T)
+      rois[~valid] = -np.inf
+      best = np.argmax(rois, axis=1)
+      roi[:, batch] = np.take_along_axis(rois, best[:, np.newaxis, :], axis=1)[:, 0, :]
+      threshold[:, batch] = np.take_along_axis(thresholds, best, axis=1)
+   return {'threshold': threshold, 'roi': roi}
+
+
+# ##############################################################################################################
+# EXACT THRESHOLDS FROM THE VALIDATION PREDICTIONS
+#
+# Sorting the validation rows by predicted probability (highest first), cumulative sums of the actuals give
+# the true and false positives of predicting positive for every row down to each one, and keeping the last
+# row of each run of equal probabilities gives the rates at every distinct threshold in O(n log n). The ROI
+# is linear in the rates, so its optimum under any payoffs is a vertex of the convex hull of the curve;
+# with hull=True only the hull is kept, which is usually a few hundred points however many rows there are.
+# ##############################################################################################################
+def exactCurve(probability, actual, hull=True):
+   if len(probability) == 0:
+      return {'threshold': np.ones(1), 'true_positive_rate': np.zeros(1), 'false_positive_rate': np.zeros(1)}
+   order = np.argsort(-np.asarray(probability), kind='stable')
+   ranked = np.asarray(probability)[order]
+   positives = np.cumsum(np.asarray(actual)[order], dtype=np.int64)
+   negatives = np.arange(1, len(ranked) + 1) - positives
+   last = np.append(ranked[1:] != ranked[:-1], True)
+   total_pos = max(int(positives[-1]), 1)
+   total_neg = max(int(negatives[-1]), 1)
+   threshold = np.append(1.0, ranked[last].astype(float))
+   tpr = np.append(0.0, positives[last] / float(total_pos))
+   fpr = np.append(0.0, negatives[last] / float(total_neg))
+   if hull:
+      keep = hullVertices(fpr, tpr)
+      threshold, tpr, fpr = threshold[keep], tpr[keep], fpr[keep]
+   return {'threshold': threshold, 'true_positive_rate': tpr, 'false_positive_rate': fpr}
+
+
+EXACT_HULL = True
+
+def getExactCurve(model):
+   def build():
+      probability, actual = cache.get_validation_predictions(model)
+      return exactCurve(probability, actual, EXACT_HULL)
+   return cache.store.get_or_fetch(('exact', model.project_id, model.id, EXACT_HULL), build)
+
+
+def hullVertices(x, y):
+   # INDICES OF THE CONVEX HULL VERTICES OF POINTS ALREADY SORTED BY x (AND BY y ON TIES). A POINT THAT DOES NOT
+   # TURN THE RIGHT WAY AGAINST ITS CURRENT NEIGHBOURS LIES ON THE WRONG SIDE OF A CHORD BETWEEN TWO OTHER POINTS,
+   # SO IT CANNOT BE A VERTEX OF THAT CHAIN. ALL SUCH POINTS ARE DROPPED AT ONCE AND THE PASS REPEATS UNTIL THE
+   # CHAIN IS CONVEX, SO EACH PASS IS A FEW ARRAY OPERATIONS OVER THE POINTS STILL KEPT.
+   def chain(direction):
+      kept = np.arange(len(x))
+      while len(kept) > 2:
+         a, b, c = kept[:-2], kept[1:-1], kept[2:]
+         cross = (x[b] - x[a]) * (y[c] - y[a]) - (y[b] - y[a]) * (x[c] - x[a])
+         drop = direction * cross >= 0
+         if not drop.any():
+            break
+         kept = np.concatenate([kept[:1], b[~drop], kept[-1:]])
+      return kept
+   return np.union1d(chain(1), chain(-1))
 
 
 def convertIntervention(cases, baserate, cost, payoff, payback, succrate, backfire):
@@ -45,8 +205,279 @@ def convertIntervention(cases, baserate, cost, payoff, payback, succrate, backfi
    fp = payback*backfire - cost
    tn = 0 
    fn = 0
-   print("True Positive Payoff: ", tp )
-   print("False Positive Payoff: ", fp )
+   # THE SIMULATION PASSES ARRAYS OF DRAWS, WHICH ARE NOT WORTH LOGGING
+   if np.ndim(tp) == 0:
+      log.info("True Positive Payoff: %s", tp)
+      log.info("False Positive Payoff: %s", fp)
    return tp, fp, tn, fn
 
- 
+
+# ##############################################################################################################
+# MONTE CARLO ROI UNCERTAINTY
+#
+# Any payoff input may be given as a distribution instead of a number:
+#
+#    "100"       a fixed value
+#    "50:150"    uniform between 50 and 150
+#    "100~20"    normal with mean 100 and standard deviation 20
+#
+# We draw every input draws times, evaluate every draw against every model's ROC points with the
+# vectorized sweep (in batches of batch_size draws to bound memory) and summarise the ROI quantiles,
+# the probability that each model is the best one, and how stable each model's optimal threshold is.
+# ##############################################################################################################
+def parseDistribution(value):
+   text = str(value).strip()
+   if ':' in text:
+      low, high = text.split(':')
+      return 'uniform', float(low), float(high)
+   if '~' in text:
+      mean, sd = text.split('~')
+      return 'normal', float(mean), float(sd)
+   return 'fixed', float(text), 0.0
+
+
+def centralValue(value):
+   kind, a, b = parseDistribution(value)
+   if kind == 'uniform':
+      return (a + b) / 2
+   return a
+
+
+def drawDistribution(value, rng, draws):
+   kind, a, b = parseDistribution(value)
+   if kind == 'uniform':
+      return rng.uniform(a, b, draws)
+   if kind == 'normal':
+      return rng.normal(a, b, draws)
+   return np.full(draws, a)
+
+
+def simulateBinaryClassModels(models, num_models, draws, seed, tp, fp, tn, fn, cases, baserate,
+                              max_workers=8, timeout=60, exact=False):
+   rng = np.random.default_rng(seed)
+   drawn = [drawDistribution(v, rng, draws) for v in (tp, fp, tn, fn, cases, baserate)]
+   drawn[5] = np.clip(drawn[5], 0, 1)
+   return simulateScenarios(models, num_models, *drawn, max_workers=max_workers, timeout=timeout, exact=exact)
+
+
+def simulateInterventionModels(models, num_models, draws, seed, cases, baserate, cost, payoff, payback,
+                               succrate, backfire, max_workers=8, timeout=60, exact=False):
+   rng = np.random.default_rng(seed)
+   cases, baserate, cost, payoff, payback, succrate, backfire = [drawDistribution(v, rng, draws) for v in
+                                              (cases, baserate, cost, payoff, payback, succrate, backfire)]
+   baserate, succrate, backfire = np.clip(baserate, 0, 1), np.clip(succrate, 0, 1), np.clip(backfire, 0, 1)
+   tp, fp, tn, fn = convertIntervention(cases=cases, baserate=baserate, cost=cost, payoff=payoff,
+                                        payback=payback, succrate=succrate, backfire=backfire)
+   return simulateScenarios(models, num_models, tp, fp, tn, fn, cases, baserate,
+                            max_workers=max_workers, timeout=timeout, exact=exact)
+
+
+def simulateScenarios(models, num_models, tp, fp, tn, fn, cases, baserate, max_workers=8, timeout=60,
+                      batch_size=5000, exact=False):
+   # RETURNS {leaderboard index: summary} FOR THE MODELS WHOSE ROC CURVES COULD BE RETRIEVED
+   pointLists = fetchCurves(models[0:num_models], max_workers, timeout, exact)
+   fetched = [i for i in range(len(pointLists)) if pointLists[i] is not None]
+   if len(fetched) == 0:
+      return {}
+   points = [pointLists[i] for i in fetched]
+   tp, fp, tn, fn, cases, baserate = np.broadcast_arrays(tp, fp, tn, fn, cases, baserate)
+   draws = len(tp)
+   rois = np.zeros((len(points), draws), dtype=np.float32)
+   thresholds = np.zeros((len(points), draws), dtype=np.float32)
+   for start in range(0, draws, batch_size):
+      batch = slice(start, start + batch_size)
+      sweep = sweepOptimalThresholds(points, tp[batch], fp[batch], tn[batch], fn[batch],
+                                     cases[batch], baserate[batch])
+      rois[:, batch] = sweep['roi']
+      thresholds[:, batch] = sweep['threshold']
+
+   quantiles = np.percentile(rois, [5, 50, 95], axis=1)
+   best = np.bincount(rois.argmax(axis=0), minlength=len(points)) / float(draws)
+   summaries = {}
+   for m, index in enumerate(fetched):
+      values, counts = np.unique(thresholds[m], return_counts=True)
+      summaries[index] = {'roi_p05': round(float(quantiles[0, m]), 0),
+                          'roi_p50': round(float(quantiles[1, m]), 0),
+                          'roi_p95': round(float(quantiles[2, m]), 0),
+                          'p_best': round(float(best[m]), 3),
+                          'threshold_p05': round(float(np.percentile(thresholds[m], 5)), 3),
+                          'threshold_p95': round(float(np.percentile(thresholds[m], 95)), 3),
+                          'threshold_mode_share': round(float(counts.max()) / draws, 3)}
+   return summaries
+
+
+# ##############################################################################################################
+# CAPACITY CONSTRAINED TARGETING
+#
+# Acting on every case scored above a threshold means contacting cases*(baserate*tpr + (1-baserate)*fpr) of
+# them. Ordering the ROC points by that volume gives cumulative true and false positive counts, and between
+# two points the counts move linearly (acting on a random share of the cases between the two thresholds),
+# so the ROI of any number of contacts is an interpolation into these arrays. With a hard capacity we take
+# the best ROI at no more than that many contacts: past the profitable cases extra contacts lose money.
+# ##############################################################################################################
+def evalCapacityModels(project, models, num_models, capacities, target_roi, tp, fp, tn, fn, cases, baserate,
+                       curve_steps=10, max_workers=8, timeout=60):
+   # RETURNS THE RESULTS OF EACH MODEL AND THE VOLUMES OF THE ROI-VS-VOLUME CURVE
+   pointLists = fetchRocPoints(models[0:num_models], max_workers, timeout)
+   volumes = np.linspace(0, cases, curve_steps + 1)
+   results = []
+   for index, (mod, points) in enumerate(zip(models, pointLists)):
+      result = modelRow(project, mod, index)
+      result['fetched'] = points is not None
+      if points is not None:
+         gains = gainsArrays(points, cases, baserate)
+         rois = volumeRoi(gains, tp, fp, tn, fn, cases, baserate)
+         best = roiAtCapacity(gains, rois, capacities)
+         result['capacity'] = [{'capacity': c, 'roi': round(float(r), 0), 'contacts': round(float(v), 0),
+                                'threshold': round(float(t), 3)}
+                               for c, r, v, t in zip(capacities, best['roi'], best['contacts'], best['threshold'])]
+         needed = capacityForRoi(gains, rois, [target_roi])[0]
+         result['target_contacts'] = None if np.isnan(needed) else round(float(needed), 0)
+         result['curve'] = [round(float(r), 0) for r in np.interp(volumes, gains['volume'], rois)]
+      results.append(result)
+   return results, [round(float(v), 0) for v in volumes]
+
+
+def gainsArrays(points, cases, baserate):
+   pos = cases * baserate
+   neg = cases - pos
+   tpr = np.array([0.0] + [point['true_positive_rate'] for point in points])
+   fpr = np.array([0.0] + [point['false_positive_rate'] for point in points])
+   thresholds = np.array([1.0] + [point['threshold'] for point in points])
+   order = np.argsort(pos * tpr + neg * fpr, kind='stable')
+   tps = pos * tpr[order]
+   fps = neg * fpr[order]
+   return {'volume': tps + fps, 'tp': tps, 'fp': fps, 'threshold': thresholds[order]}
+
+
+def volumeRoi(gains, tp, fp, tn, fn, cases, baserate):
+   pos = cases * baserate
+   neg = cases - pos
+   return gains['tp'] * tp + gains['fp'] * fp + (neg - gains['fp']) * tn + (pos - gains['tp']) * fn
+
+
+def roiAtCapacity(gains, rois, capacities):
+   # THE BEST ROI, THE CONTACTS THAT ACHIEVE IT AND THE THRESHOLD TO USE, FOR EACH CAPACITY
+   capacities = np.atleast_1d(np.asarray(capacities, dtype=float))
+   volume = gains['volume']
+   limited = np.clip(capacities, 0, volume[-1])
+   at = np.interp(limited, volume, rois)
+   # RUNNING BEST OVER THE ROC POINTS, KEEPING THE FIRST (FEWEST CONTACTS) POINT ON A TIE
+   previous = np.concatenate([[-np.inf], np.maximum.accumulate(rois)[:-1]])
+   best_point = np.maximum.accumulate(np.where(rois > previous, np.arange(len(rois)), 0))
+   below = best_point[np.searchsorted(volume, limited, side='right') - 1]
+   use_capacity = at > rois[below]
+   contacts = np.where(use_capacity, limited, volume[below])
+   point = np.where(use_capacity, np.searchsorted(volume, limited, side='right') - 1, below)
+   return {'roi': np.where(use_capacity, at, rois[below]),
+           'contacts': contacts,
+           'threshold': gains['threshold'][point]}
+
+
+def capacityForRoi(gains, rois, targets):
+   # THE FEWEST CONTACTS THAT REACH EACH TARGET ROI (nan WHEN IT CANNOT BE REACHED)
+   targets = np.atleast_1d(np.asarray(targets, dtype=float))
+   volume = gains['volume']
+   reached = rois[np.newaxis, :] >= targets[:, np.newaxis]
+   first = np.argmax(reached, axis=1)
+   before = np.maximum(first - 1, 0)
+   step = rois[first] - rois[before]
+   with np.errstate(divide='ignore', invalid='ignore'):
+      share = np.where(step > 0, (targets - rois[before]) / step, 1.0)
+   contacts = volume[before] + share * (volume[first] - volume[before])
+   contacts = np.where(first == 0, volume[0], contacts)
+   return np.where(reached.any(axis=1), contacts, np.nan)
+
+
+# ##############################################################################################################
+# REGRESSION ROI
+#
+# The regression analyses work on the validation actuals and predictions of each model, which are
+# downloaded once and cached as float32 arrays. They are every validation row when the project's actuals
+# can be read (cache.get_validation_residuals); otherwise they come from the residuals chart, which
+# DataRobot caps at a random sample of 1000 rows. The arrays of all models are padded into
+# (models, rows) matrices with a validity mask, so each analysis is a single vectorized pass however many
+# models and residuals there are. Errors are percentages of the actual value; rows with an actual of zero
+# have no percentage error and are left out.
+# ##############################################################################################################
+def evalRegressionModels(project, models, num_models, analysis, max_workers=8, timeout=60, **params):
+   results = []
+   if cache.actuals_available(project):
+      residuals = fetchConcurrently(cache.get_validation_residuals, models[0:num_models], max_workers, timeout)
+   else:
+      residuals = fetchConcurrently(cache.get_residuals, models[0:num_models], max_workers, timeout, 'validation')
+   fetched = [i for i in range(len(residuals)) if residuals[i] is not None]
+   costs = analysis([residuals[i] for i in fetched], **params)
+   position = {i: fetched.index(i) for i in fetched}
+   for index, mod in enumerate(models):
+      result = modelRow(project, mod, index)
+      if index in position:
+          result['cost'] = round(float(costs[position[index]]), 0)
+      else:
+          result['cost'] = "?"
+      results.append(result)
+   return results
+
+
+def residualArrays(residuals):
+   num_rows = max([len(actual) for actual, predicted in residuals] + [1])
+   actuals = np.zeros((len(residuals), num_rows), dtype=np.float32)
+   predictions = np.zeros((len(residuals), num_rows), dtype=np.float32)
+   valid = np.zeros((len(residuals), num_rows), dtype=bool)
+   for m, (actual, predicted) in enumerate(residuals):
+      actuals[m, 0:len(actual)] = actual
+      predictions[m, 0:len(predicted)] = predicted
+      valid[m, 0:len(actual)] = True
+   return actuals, predictions, valid
+
+
+def percentErrors(residuals):
+   actuals, predictions, valid = residualArrays(residuals)
+   valid = valid & (actuals != 0)
+   with np.errstate(divide='ignore', invalid='ignore'):
+      errors = 100 * (predictions - actuals) / np.abs(actuals)
+   return np.where(valid, errors, 0), valid
+
+
+# ##############################################################################################################
+# DISCRETE: A PREDICTION MORE THAN over_pct TOO HIGH COSTS over_cost, ONE MORE THAN under_pct TOO LOW
+# COSTS under_cost. RETURNS THE EXPECTED TOTAL COST OVER cases PREDICTIONS FOR EACH MODEL.
+# ##############################################################################################################
+def discreteErrorCost(residuals, over_pct, over_cost, under_pct, under_cost, cases):
+   errors, valid = percentErrors(residuals)
+   over = (valid & (errors > over_pct)).sum(axis=1)
+   under = (valid & (errors < -under_pct)).sum(axis=1)
+   counts = np.maximum(valid.sum(axis=1), 1)
+   return cases * (over * over_cost + under * under_cost) / counts
+
+
+# ##############################################################################################################
+# CONTINUOUS: EVERY 1% OF ERROR BEYOND tolerance_pct (IN EITHER DIRECTION) COSTS cost_per_pct.
+# ##############################################################################################################
+def continuousErrorCost(residuals, tolerance_pct, cost_per_pct, cases):
+   errors, valid = percentErrors(residuals)
+   excess = np.where(valid, np.maximum(np.abs(errors) - tolerance_pct, 0), 0)
+   counts = np.maximum(valid.sum(axis=1), 1)
+   return cases * cost_per_pct * excess.sum(axis=1) / counts
+
+
+# ##############################################################################################################
+# AGGREGATE: PREDICTIONS ARE AGGREGATED IN GROUPS OF group_size ROWS AND EACH GROUP COSTS cost_per_unit
+# FOR EVERY unit_pct OF ERROR IN ITS TOTAL. RETURNS THE EXPECTED COST OVER num_groups GROUPS.
+# ##############################################################################################################
+def aggregateErrorCost(residuals, group_size, unit_pct, cost_per_unit, num_groups):
+   group_size = max(1, int(group_size))
+   actuals, predictions, valid = residualArrays(residuals)
+   padding = (-actuals.shape[1]) % group_size
+   actuals = np.pad(np.where(valid, actuals, 0), ((0, 0), (0, padding)))
+   predictions = np.pad(np.where(valid, predictions, 0), ((0, 0), (0, padding)))
+   valid = np.pad(valid, ((0, 0), (0, padding)))
+   shape = (actuals.shape[0], -1, group_size)
+   actual_totals = actuals.reshape(shape).sum(axis=2, dtype=np.float64)
+   predicted_totals = predictions.reshape(shape).sum(axis=2, dtype=np.float64)
+   groups = valid.reshape(shape).any(axis=2) & (actual_totals != 0)
+   with np.errstate(divide='ignore', invalid='ignore'):
+      errors = 100 * np.abs(predicted_totals - actual_totals) / np.abs(actual_totals)
+   costs = np.where(groups, cost_per_unit * errors / unit_pct, 0)
+   return num_groups * costs.sum(axis=1) / np.maximum(groups.sum(axis=1), 1)
+
@@ -0,0 +1,222 @@
+# ##############################################################################################################
+# SCORING
+#
+# Frames are split into batches of at most batch_rows rows and several batches are kept in flight at once,
+# so uploading one batch overlaps with scoring and downloading the others. Predictions are reassembled in
+# the order of the input rows.
+#
+# The work of scoring a single batch is done by a backend. DataRobotScorer is the live service; the local
+# backends stand in for it for offline runs and tests. Every backend returns a frame with one row per input
+# row containing at least 'row_id', 'prediction' and 'positive_probability'.
+# ##############################################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import datarobot as dr
+import numpy as np
+import pandas as pd
+import hashlib
+import logging
+import pickle
+import time
+import os
+import cache
+import datasets
+import metrics
+
+log = logging.getLogger(__name__)
+
+BATCH_ROWS = 50000
+MAX_IN_FLIGHT = 4
+
+
+class Scorer(object):
+
+    # IDENTIFIES THE MODEL BEHIND THIS SCORER IN THE PREDICTION CACHE (None DISABLES CACHING)
+    key = None
+
+    def score(self, pdata):
+        raise NotImplementedError()
+
+    # THE COLUMNS THE MODEL ACTUALLY READS (None MEANS ALL OF THEM)
+    def features(self):
+        return None
+
+
+class DataRobotScorer(Scorer):
+
+    def __init__(self, project, model, max_wait=600):
+        self.project = project
+        self.model = model
+        self.max_wait = max_wait
+        self.key = "datarobot:%s:%s" % (project.id, model.id)
+
+    def score(self, pdata):
+        # A FRAME ALREADY UPLOADED TO THIS PROJECT IS SCORED FROM ITS EXISTING PREDICTION DATASET. IF DATAROBOT
+        # REJECTS THAT DATASET (EXPIRED OR DELETED) THE MAPPING IS DROPPED AND THE FRAME UPLOADED AGAIN; ANY
+        # OTHER FAILURE, SUCH AS A TIMEOUT WAITING FOR THE PREDICTIONS, IS RAISED.
+        digest = datasets.frame_digest(pdata)
+        dataset_id = datasets.store.remote_id(self.project.id, digest)
+        pred_job = None
+        if dataset_id is not None:
+            try:
+                pred_job = self.request(dataset_id)
+            except dr.errors.ClientError as e:
+                log.warning("Stored dataset %s was rejected, uploading again: %s", dataset_id, e)
+                datasets.store.forget_remote_id(self.project.id, digest)
+        if pred_job is None:
+            with metrics.remote_call('upload_dataset'):
+                dataset_id = self.project.upload_dataset(pdata).id
+            datasets.store.set_remote_id(self.project.id, digest, dataset_id)
+            pred_job = self.request(dataset_id)
+        with metrics.remote_call('wait_for_async_predictions'):
+            return dr.models.predict_job.wait_for_async_predictions(self.project.id, predict_job_id=pred_job.id,
+                                                                    max_wait=self.max_wait)
+
+    def request(self, dataset_id):
+        with metrics.remote_call('request_predictions'):
+            return self.model.request_predictions(dataset_id)
+
+    def features(self):
+        return cache.get_features_used(self.model)
+
+
+# ##############################################################################################################
+# A PICKLED SCIKIT-LEARN CLASSIFIER (ANYTHING WITH predict_proba AND classes_)
+# ##############################################################################################################
+class PickleScorer(Scorer):
+
+    def __init__(self, path, positive_class=1, columns=None):
+        with open(path, 'rb') as f:
+            self.estimator = pickle.load(f)
+        self.key = "pickle:%s:%s" % (path, os.path.getmtime(path))
+        self.positive_class = positive_class
+        self.columns = columns
+        if self.columns is None and hasattr(self.estimator, 'feature_names_in_'):
+            self.columns = list(self.estimator.feature_names_in_)
+
+    def score(self, pdata):
+        features = pdata[self.columns] if self.columns is not None else pdata
+        probs = self.estimator.predict_proba(features)
+        classes = list(self.estimator.classes_)
+        positive = probs[:, classes.index(self.positive_class)]
+        return prediction_frame(positive, np.asarray(classes)[probs.argmax(axis=1)])
+
+    def features(self):
+        return self.columns
+
+
+# ##############################################################################################################
+# A DETERMINISTIC FAKE - THE PROBABILITY IS A FIXED FUNCTION OF THE ROW CONTENTS
+# ##############################################################################################################
+class FakeScorer(Scorer):
+
+    def __init__(self, columns=None, positive_class=1, negative_class=0):
+        self.key = "fake"
+        self.columns = columns
+        self.positive_class = positive_class
+        self.negative_class = negative_class
+
+    def score(self, pdata):
+        features = pdata[self.columns] if self.columns is not None else pdata
+        hashed = pd.util.hash_pandas_object(features, index=False).values
+        positive = (hashed % 1000003) / 1000003.0
+        labels = np.where(positive >= 0.5, self.positive_class, self.negative_class)
+        return prediction_frame(positive, labels)
+
+    def features(self):
+        return self.columns
+
+
+# ##############################################################################################################
+# LOOK UP CACHED PREDICTIONS FIRST AND SEND ONLY THE UNIQUE MISSES TO THE WRAPPED SCORER
+# ROWS ARE HASHED ON THE MODEL'S FEATURES ONLY, SO ROWS THAT DIFFER JUST IN THE TARGET OR AN ID
+# COLUMN SHARE A CACHE ENTRY.
+# ##############################################################################################################
+class CachedScorer(Scorer):
+
+    def __init__(self, scorer, store=None):
+        self.scorer = scorer
+        self.store = store if store is not None else cache.predictions
+        self.key = scorer.key
+
+    def features(self):
+        return self.scorer.features()
+
+    def score(self, pdata):
+        features = self.features()
+        columns = sorted(c for c in pdata.columns if features is None or c in features)
+        scope = hashlib.sha1((self.key + "|" + "|".join(columns)).encode('utf-8')).hexdigest()
+        hashed = pd.util.hash_pandas_object(pdata[columns], index=False).values.view(np.int64)
+        codes, uniques = pd.factorize(hashed)
+        found = self.store.lookup(scope, uniques.tolist())
+        labels = [None] * len(uniques)
+        positive = np.zeros(len(uniques))
+        missing = []
+        for i, row in enumerate(uniques.tolist()):
+            if row in found:
+                labels[i], positive[i] = found[row]
+            else:
+                missing.append(i)
+        if len(missing) > 0:
+            first = np.unique(codes, return_index=True)[1]
+            scored = self.scorer.score(pdata.iloc[first[missing]])
+            new_labels = scored['prediction'].tolist()
+            new_positive = scored['positive_probability'].values
+            for j, i in enumerate(missing):
+                labels[i] = new_labels[j]
+                positive[i] = new_positive[j]
+            self.store.save(scope, uniques[missing].tolist(), new_labels, new_positive.tolist())
+        return prediction_frame(positive[codes], np.asarray(labels, dtype=object)[codes])
+
+
+def cached(scorer):
+    if scorer.key is None or isinstance(scorer, CachedScorer):
+        return scorer
+    return CachedScorer(scorer)
+
+
+def prediction_frame(positive, labels):
+    return pd.DataFrame({'row_id': np.arange(len(positive)),
+                         'prediction': labels,
+                         'positive_probability': positive})
+
+
+##################################################################################################################
+# SPLIT FRAMES INTO BATCHES AND KEEP A BOUNDED NUMBER OF THEM IN FLIGHT
+##################################################################################################################
+def split_batches(pdata, batch_rows=BATCH_ROWS):
+    for start in range(0, len(pdata), batch_rows):
+        yield pdata.iloc[start:start + batch_rows]
+
+
+def timed_score(scorer, batch):
+    start = time.perf_counter()
+    scored = scorer.score(batch)
+    metrics.record_scored(len(batch), time.perf_counter() - start)
+    return scored
+
+
+def score_stream(scorer, frames, batch_rows=BATCH_ROWS, max_in_flight=MAX_IN_FLIGHT):
+    # YIELDS THE SCORED BATCHES OF A SEQUENCE OF FRAMES, IN ORDER, AS SOON AS EACH ONE IS READY
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    pending = deque()
+    try:
+        for frame in frames:
+            for batch in split_batches(frame, batch_rows):
+                pending.append(executor.submit(timed_score, scorer, batch))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def score_frame(scorer, pdata, batch_rows=BATCH_ROWS, max_in_flight=MAX_IN_FLIGHT):
+    scored = list(score_stream(scorer, [pdata], batch_rows, max_in_flight))
+    if len(scored) == 0:
+        return prediction_frame(np.zeros(0), np.zeros(0))
+    preds = pd.concat(scored).reset_index(drop=True)
+    preds['row_id'] = np.arange(len(preds))
+    return preds
@@ -0,0 +1,88 @@
+import threading
+import io
+import os
+
+import pytest
+
+import app as webapp
+import jobs
+
+
+@pytest.fixture
+def client():
+    return webapp.app.test_client()
+
+
+@pytest.mark.parametrize("form, message", [
+    ({'mode': 'brute_force'}, b"Select at least one model"),
+    ({'mode': 'progressive', 'modelId': ['a', 'b']}, b"Only the brute force search can compare several models"),
+    ({'mode': 'adaptive', 'modelId': ['a']}, b"Select at least one column to optimise"),
+])
+def test_runoptimization_rejects_invalid_forms_before_submitting_a_job(client, form, message):
+    response = client.post('/runoptimization', data=dict(form, projectId='p'))
+    assert response.status_code == 200
+    assert message in response.data
+
+
+class Listed(object):
+
+    def __init__(self, i):
+        self.id = 'p%i' % i
+        self.project_name = 'Project %i' % i
+
+
+@pytest.fixture
+def listing(monkeypatch):
+    calls = []
+
+    def fake_list(search_params=None, offset=None, limit=None):
+        calls.append((search_params, offset, limit))
+        return [Listed(i) for i in range(offset, min(offset + limit, 7))]
+    monkeypatch.setattr(webapp.cache.dr.Project, 'list', fake_list)
+    monkeypatch.setattr(webapp.cache, 'listing', webapp.cache.Cache(None, 60, 10))
+    return calls
+
+
+def test_api_projects_passes_the_search_and_page_to_datarobot(client, listing):
+    data = client.get('/api/projects?q=churn&page=2&per_page=3').get_json()
+    assert listing == [({'project_name': 'churn'}, 3, 4)]
+    assert [p['id'] for p in data['projects']] == ['p3', 'p4', 'p5']
+    assert data['more'] is True
+    assert client.get('/api/projects?page=3&per_page=3').get_json()['more'] is False
+
+
+def test_malformed_paging_falls_back_to_defaults_and_is_clamped(client, listing):
+    assert client.get('/?page=abc').status_code == 200
+    data = client.get('/api/projects?page=-4&per_page=100000').get_json()
+    assert data['page'] == 1
+    assert data['per_page'] == webapp.app.config['PROJECTS_MAX_PER_PAGE']
+    data = client.get('/api/projects?per_page=xyz').get_json()
+    assert data['per_page'] == webapp.app.config['PROJECTS_PER_PAGE']
+
+
+def test_identical_pending_uploads_share_one_job(client, monkeypatch, tmp_path):
+    release = threading.Event()
+    started = []
+
+    def slow_job(projectId, modelId, filepath, digest, mode, colOne, colTwo, columns, progress=None):
+        started.append(filepath)
+        release.wait(10)
+        os.remove(filepath)
+    monkeypatch.setattr(webapp, 'run_optimization_job', slow_job)
+    monkeypatch.setattr(jobs, 'runner', jobs.JobRunner(2))
+    monkeypatch.setitem(webapp.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+
+    def post(content):
+        form = {'projectId': 'p', 'modelId': 'm', 'mode': 'brute_force', 'colone': 'a', 'coltwo': 'b',
+                'file': (io.BytesIO(content), 'data.csv')}
+        return client.post('/runoptimization', data=form, content_type='multipart/form-data').headers['Location']
+    try:
+        first, second, other = post(b"a,b\n1,2\n"), post(b"a,b\n1,2\n"), post(b"a,b\n3,4\n")
+    finally:
+        release.set()
+    assert first == second
+    assert other != first
+    jobs.runner.executor.shutdown(wait=True)
+    assert len(started) == 2
+    # THE SHARED SUBMISSION'S COPY OF THE UPLOAD IS REMOVED STRAIGHT AWAY, THE OTHERS BY THEIR JOBS
+    assert os.listdir(str(tmp_path)) == []
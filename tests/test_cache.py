@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+
+
+def test_expired_file_is_deleted_on_read(tmp_path):
+    store = cache.Cache(str(tmp_path), 60, 10)
+    store.put(('roc', 'p', 'm'), [1, 2, 3])
+    store.ttl = -1
+    store.items.clear()
+    assert store.get(('roc', 'p', 'm')) == (False, None)
+    assert not os.path.exists(store.path(('roc', 'p', 'm')))
+
+
+def test_folder_is_capped_at_max_files(tmp_path):
+    store = cache.Cache(str(tmp_path), None, 100, max_files=10)
+    for i in range(25):
+        store.put(('item', i), i)
+    assert len(store.stored_files()) <= 10
+    assert store.get(('item', 24)) == (True, 24)
+
+
+class FakeTraining(object):
+
+    def __init__(self, model_id, data_subset, partitions):
+        self.model_id = model_id
+        self.data_subset = data_subset
+        self.partitions = partitions
+
+    def get_all_as_dataframe(self):
+        return pd.DataFrame({'row_id': np.arange(len(self.partitions)), 'partition_id': self.partitions,
+                             'prediction': np.arange(len(self.partitions)) * 1.5})
+
+
+class FakeModel(object):
+    id = 'm'
+    project_id = 'p'
+
+    def __init__(self, requested):
+        self.requested = requested
+
+    def request_training_predictions(self, subset):
+        training = FakeTraining(self.id, subset, self.requested)
+        return type('Job', (), {'get_result_when_complete': lambda job: training})()
+
+
+def fake_training_predictions(monkeypatch, existing):
+    monkeypatch.setattr(cache, 'get_training_targets', lambda project: np.arange(100, 106))
+    monkeypatch.setattr(cache.dr.TrainingPredictions, 'list', staticmethod(lambda project_id: existing))
+
+
+def test_validation_rows_skip_holdout_only_predictions(monkeypatch):
+    fake_training_predictions(monkeypatch, [FakeTraining('m', 'holdout', ['Holdout'] * 6),
+                                            FakeTraining('other', 'all', ['0.0'] * 6)])
+    model = FakeModel(['0.0', 'Holdout', '0.0', '1.0', '0.0', 'Holdout'])
+    preds, targets = cache.get_validation_rows(None, model)
+    assert list(preds['row_id']) == [0, 2, 4]
+    assert list(targets) == [100, 102, 104]
+
+
+def test_validation_rows_raise_when_there_are_none(monkeypatch):
+    fake_training_predictions(monkeypatch, [FakeTraining('m', 'all', ['1.0', 'Holdout'])])
+    with pytest.raises(ValueError):
+        cache.get_validation_rows(None, FakeModel([]))
+
+
+def test_prediction_cache_evicts_the_least_recently_used_rows(monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr(cache.time, 'time', lambda: float(next(clock)))
+    predictions = cache.PredictionCache(':memory:', 4)
+    predictions.save('s', [1, 2, 3, 4], ['a', 'b', 'c', 'd'], [0.1, 0.2, 0.3, 0.4])
+    assert predictions.lookup('s', [1, 2]) == {1: ('a', 0.1), 2: ('b', 0.2)}
+    predictions.save('s', [5, 6], ['e', 'f'], [0.5, 0.6])
+    assert sorted(predictions.lookup('s', [1, 2, 3, 4, 5, 6])) == [1, 2, 5, 6]
+    assert predictions.stats()['rows'] == 4
+
+
+def test_validation_subsets_match_the_client_enums():
+    subsets = cache.dr.enums.DATA_SUBSET
+    assert cache.VALIDATION_SUBSETS == set([str(subsets.ALL), str(subsets.VALIDATION_AND_HOLDOUT)])
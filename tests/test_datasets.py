@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import datasets
+import scoring
+import opti
+
+
+def test_upload_is_converted_in_parts_and_read_back_by_column(tmp_path):
+    data = pd.DataFrame({'id': np.arange(1050), 'x': np.arange(1050) * 0.5, 'label': ['a', 'b', 'c'] * 350})
+    # A MISSING VALUE IN A LATER CHUNK ONLY, SO THE PARTS HAVE DIFFERENT TYPES FOR THE SAME COLUMN
+    data['count'] = np.arange(1050).astype(object)
+    data.loc[1000, 'count'] = None
+    path = str(tmp_path / "upload.csv")
+    data.to_csv(path, index=False)
+
+    store = datasets.DatasetStore(str(tmp_path / "store"), 1 << 30, chunk_rows=400)
+    digest = store.add(path)
+    assert store.add(path) == digest
+    assert store.rows(digest) == 1050
+    assert len(store.index['files'][digest]['parts']) == 3
+
+    loaded = store.load(digest, ['label', 'id', 'count'])
+    assert list(loaded.columns) == ['id', 'label', 'count']
+    assert (loaded['id'].values == data['id'].values).all()
+    assert loaded['count'].isna().sum() == 1
+
+    sample, rows = opti.sample_chunks(store.chunks(digest, ['id', 'x']), 300, seed=0)
+    assert rows == 1050 and len(sample) == 300 and sample['id'].is_unique
+    assert (sample['x'].values == sample['id'].values * 0.5).all()
+
+
+def test_remote_ids_are_capped(tmp_path):
+    store = datasets.DatasetStore(str(tmp_path), 1 << 30, max_remote=3)
+    for i in range(5):
+        store.set_remote_id('p', str(i), 'dataset-%i' % i)
+    assert len(store.index['remote']) == 3
+    assert store.remote_id('p', '4') == 'dataset-4'
+    store.forget_remote_id('p', '4')
+    assert store.remote_id('p', '4') is None
+
+
+class FakeProject(object):
+    id = 'project'
+
+    def __init__(self):
+        self.uploads = 0
+
+    def upload_dataset(self, pdata):
+        self.uploads += 1
+        return type('Dataset', (), {'id': 'fresh-%i' % self.uploads})
+
+
+class FakeModel(object):
+    id = 'model'
+
+    def request_predictions(self, dataset_id):
+        if not dataset_id.startswith('fresh'):
+            raise scoring.dr.errors.ClientError("dataset %s not found" % dataset_id, 404)
+        return type('PredictJob', (), {'id': dataset_id})
+
+
+def test_scorer_uploads_again_when_a_stored_dataset_is_gone(tmp_path, monkeypatch):
+    monkeypatch.setattr(datasets, 'store', datasets.DatasetStore(str(tmp_path), 1 << 30))
+    monkeypatch.setattr(scoring.dr.models.predict_job, 'wait_for_async_predictions',
+                        lambda project_id, predict_job_id, max_wait: predict_job_id)
+    pdata = pd.DataFrame({'x': [1, 2, 3]})
+    project = FakeProject()
+    datasets.store.set_remote_id(project.id, datasets.frame_digest(pdata), 'expired')
+
+    scorer = scoring.DataRobotScorer(project, FakeModel())
+    assert scorer.score(pdata) == 'fresh-1'
+    assert datasets.store.remote_id(project.id, datasets.frame_digest(pdata)) == 'fresh-1'
+    assert scorer.score(pdata) == 'fresh-1'
+    assert project.uploads == 1
+
+
+def test_scorer_does_not_upload_again_when_waiting_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(datasets, 'store', datasets.DatasetStore(str(tmp_path), 1 << 30))
+
+    def timeout(project_id, predict_job_id, max_wait):
+        raise scoring.dr.errors.AsyncTimeoutError("predictions took too long")
+    monkeypatch.setattr(scoring.dr.models.predict_job, 'wait_for_async_predictions', timeout)
+    pdata = pd.DataFrame({'x': [1, 2, 3]})
+    project = FakeProject()
+    datasets.store.set_remote_id(project.id, datasets.frame_digest(pdata), 'fresh-stored')
+
+    with pytest.raises(scoring.dr.errors.AsyncTimeoutError):
+        scoring.DataRobotScorer(project, FakeModel()).score(pdata)
+    assert project.uploads == 0
+    assert datasets.store.remote_id(project.id, datasets.frame_digest(pdata)) == 'fresh-stored'
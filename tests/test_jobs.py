@@ -0,0 +1,61 @@
+import threading
+import time
+
+import jobs
+
+
+def wait_for(runner, job):
+    # UNTIL THE JOB HAS FINISHED AND GIVEN UP ITS KEY
+    while job.finished is None or runner.active.get(job.key) is job:
+        time.sleep(0.01)
+
+
+def test_job_reports_progress_and_result():
+    runner = jobs.JobRunner(1)
+    reported, release = threading.Event(), threading.Event()
+
+    def work(value, progress=None):
+        progress('scoring', 40)
+        reported.set()
+        release.wait(10)
+        return value * 2
+    job = runner.submit('a', work, 21)
+    reported.wait(10)
+    assert job.to_dict() == {'id': job.id, 'status': 'running', 'phase': 'scoring', 'percent': 40, 'error': None}
+    release.set()
+    wait_for(runner, job)
+    assert job.status == 'done' and job.result == 42 and job.percent == 100
+    assert runner.get(job.id) is job
+
+
+def test_failed_job_records_the_error():
+    runner = jobs.JobRunner(1)
+
+    def work(progress=None):
+        raise ValueError("no rows")
+    job = runner.submit('a', work)
+    wait_for(runner, job)
+    assert job.status == 'failed' and job.error == "no rows"
+
+
+def test_identical_pending_submissions_share_a_job():
+    runner = jobs.JobRunner(2)
+    release = threading.Event()
+    calls = []
+
+    def work(name, progress=None):
+        calls.append(name)
+        release.wait(10)
+        return name
+    first = runner.submit('same', work, 'first')
+    second = runner.submit('same', work, 'second')
+    other = runner.submit('different', work, 'other')
+    release.set()
+    wait_for(runner, first)
+    wait_for(runner, other)
+    assert first is second and other is not first
+    assert sorted(calls) == ['first', 'other']
+    # ONCE FINISHED THE KEY IS FREE, SO THE SAME SUBMISSION STARTS A NEW JOB
+    again = runner.submit('same', work, 'again')
+    wait_for(runner, again)
+    assert again is not first and again.result == 'again'
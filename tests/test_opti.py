@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+import synthetic
+import scoring
+import cache
+import opti
+
+
+def test_vectorized_optimum_matches_per_row_search():
+    sample = synthetic.tabular(40, [6, 4, 3, None], seed=3)
+    features = [c for c in sample.columns if c != 'target']
+    col1vals = opti.profile_feature(sample, 'x0').values
+    col2vals = opti.profile_feature(sample, 'x1').values
+    records = len(sample)
+
+    sim = opti.get_simulated_data(sample, 'x0', col1vals, 'x1', col2vals).reset_index(drop=True)
+    scores = scoring.FakeScorer(columns=features).score(sim)['positive_probability'].values
+    maxvals, onevals, twovals = opti.get_optimal_combinations(scores, records, col1vals, col2vals)
+
+    # REFERENCE: EVERY ROW IS COMPARED ONLY WITH ITS OWN SIMULATED COPIES
+    sim['positive_probability'] = scores
+    sim['row'] = np.tile(np.arange(records), len(col1vals) * len(col2vals))
+    for row, block in sim.groupby('row'):
+        best = block.loc[block['positive_probability'].idxmax()]
+        assert np.isclose(maxvals[row], best['positive_probability'])
+        assert onevals[row] == best['x0']
+        assert twovals[row] == best['x1']
+
+
+def test_sample_csv_returns_real_rows_and_the_row_count(tmp_path):
+    data = synthetic.tabular(2500, [10, None], seed=1)
+    data['id'] = np.arange(len(data))
+    path = str(tmp_path / "data.csv")
+    data.to_csv(path, index=False)
+    sample, total = opti.sample_csv(path, columns=['id', 'x0'], sample_size=300, seed=0, chunksize=400)
+    assert total == 2500
+    assert len(sample) == 300
+    assert list(sample.columns) == ['x0', 'id']
+    assert sample['id'].is_unique
+    assert (data.set_index('id').loc[sample['id'], 'x0'].values == sample['x0'].values).all()
+
+
+def test_sample_csv_is_uniform_over_chunks(tmp_path):
+    path = str(tmp_path / "ids.csv")
+    synthetic.tabular(1000, [2], seed=0).assign(id=np.arange(1000)).to_csv(path, index=False)
+    counts = np.zeros(1000)
+    for seed in range(200):
+        sample, total = opti.sample_csv(path, columns=['id'], sample_size=100, seed=seed, chunksize=150)
+        counts[sample['id'].values] += 1
+    # EVERY ROW SHOULD BE KEPT ABOUT 10% OF THE TIME, WHICHEVER CHUNK IT IS IN
+    first, last = counts[0:150].mean() / 200, counts[850:].mean() / 200
+    assert abs(first - 0.1) < 0.02 and abs(last - 0.1) < 0.02
+
+
+def test_calibration_resamples_do_not_depend_on_the_processes():
+    rng = np.random.default_rng(0)
+    expected = rng.uniform(0.05, 0.6, size=400)
+    actual = rng.uniform(size=400) < expected * 1.1
+    for method in ['bootstrap', 'kfold']:
+        local = opti.calibration_adjustments(actual, expected, method, resamples=120, processes=1)
+        spawned = opti.calibration_adjustments(actual, expected, method, resamples=120, processes=2)
+        assert len(local) == 120
+        assert np.array_equal(local, spawned)
+
+
+class Project(object):
+    id = 'project'
+    target = 'target'
+    positive_class = 1
+
+
+class Model(object):
+    id = 'model'
+
+
+@pytest.fixture
+def fresh_caches(monkeypatch):
+    # SCORES GO TO A PRIVATE IN-MEMORY PREDICTION CACHE, NOT THE SHARED ONE ON DISK
+    monkeypatch.setattr(cache, 'predictions', cache.PredictionCache(':memory:', 10 ** 6))
+    opti.profile_cache.clear()
+
+
+def progressive(data, progress=None, **options):
+    scorer = scoring.FakeScorer(columns=['x0', 'x1', 'x2'])
+    return opti.run_progressive_brute_force(Project(), Model(), data, 'x0', 'x1', scorer=scorer,
+                                            progress=progress, sample_size=len(data), **options)
+
+
+def test_progressive_batches_double_and_calls_match_the_rows_scored(fresh_caches):
+    data = synthetic.tabular(1000, [4, 3, 5], seed=5)
+    seen = []
+    progress = lambda phase, percent: seen.append((phase, percent))
+    total, lb, ub, f1c, f2c, report = progressive(data, progress, max_width_pct=0.0)
+    # THE PROGRESS BEFORE EACH BATCH IS 5 + 90 * ROWS SCORED SO FAR / RECORDS
+    used = [round((p - 5) / 90 * 1000) for phase, p in seen if phase == 'progressive scoring']
+    assert np.diff(used + [report['rows']]).tolist() == [100, 100, 200, 400, 200]
+    assert report['stopped'] == 'sample exhausted' and report['rows'] == 1000
+    grid = len(opti.profile_feature(data, 'x0').values) * len(opti.profile_feature(data, 'x1').values)
+    assert report['calls'] == report['rows'] * (1 + grid)
+
+
+def test_progressive_never_exceeds_the_call_budget(fresh_caches):
+    data = synthetic.tabular(1000, [4, 3, 5], seed=5)
+    total, lb, ub, f1c, f2c, report = progressive(data, max_width_pct=0.0, call_budget=5000)
+    assert report['stopped'] == 'call budget'
+    assert 0 < report['calls'] <= 5000
+    grid = len(opti.profile_feature(data, 'x0').values) * len(opti.profile_feature(data, 'x1').values)
+    assert report['calls'] == report['rows'] * (1 + grid)
+
+
+def test_progressive_stops_when_the_interval_is_narrow_enough(fresh_caches):
+    data = synthetic.tabular(1000, [4, 3, 5], seed=5)
+    total, lb, ub, f1c, f2c, report = progressive(data, max_width_pct=1000.0)
+    assert report['stopped'] == 'interval width'
+    assert report['rows'] == 100 and report['width_pct'] <= 1000.0
+
+
+def test_coordinate_ascent_calls_and_gap_against_the_full_grid(fresh_caches):
+    data = synthetic.tabular(120, [4, 3, 5], seed=6)
+    columns = ['x0', 'x1', 'x2']
+    scorer = scoring.FakeScorer(columns=columns)
+    total, lb, ub, changes, report = opti.run_coordinate_ascent(Project(), Model(), data, columns, scorer=scorer,
+                                                                max_rounds=1, compare_limit=10 ** 6,
+                                                                sample_size=len(data))
+    candidates = [opti.profile_feature(data, c).values for c in columns]
+    assert report['calls'] == len(data) * (1 + sum(len(v) for v in candidates))
+
+    scores = np.concatenate([scorer.score(block)['positive_probability'].values
+                             for block in opti.iter_grid_data(data, columns, candidates)])
+    maxvals, chosen = opti.get_optimal_grid(scores, len(data), candidates)
+    assert np.isclose(report['brute_force_optimised'], maxvals.sum())
+    assert report['optimised'] <= maxvals.sum() + 1e-9
+    assert report['gap_pct'] >= 0
@@ -0,0 +1,219 @@
+import threading
+import time
+
+import numpy as np
+
+import synthetic
+import roi
+
+
+def loop_optimal_threshold(points, tp, fp, tn, fn, cases, baserate):
+    # THE ORIGINAL PER-POINT SEARCH THE VECTORIZED SWEEP REPLACED
+    pos = cases * baserate
+    neg = cases - pos
+    thresh, best = 1.0, -999999
+    for point in points:
+        temp = (neg * point['true_negative_rate'] * tn) + (neg * point['false_positive_rate'] * fp) + \
+               (pos * point['true_positive_rate'] * tp) + (pos * (1 - point['true_positive_rate']) * fn)
+        if temp > best:
+            best, thresh = temp, point['threshold']
+    return thresh, best
+
+
+def test_sweep_matches_loop_for_every_model_and_scenario():
+    point_lists = [synthetic.roc_points(n, seed) for seed, n in enumerate([50, 80, 120])]
+    tp = np.array([1000, 50, 300])
+    fp = np.array([-200, -100, -10])
+    sweep = roi.sweepOptimalThresholds(point_lists, tp, fp, 0, -20, 1000, 0.05)
+    for m, points in enumerate(point_lists):
+        for s in range(len(tp)):
+            thresh, best = loop_optimal_threshold(points, tp[s], fp[s], 0, -20, 1000, 0.05)
+            assert sweep['threshold'][m, s] == thresh
+            assert np.isclose(sweep['roi'][m, s], best)
+
+
+def test_sweep_batches_scenarios_without_changing_results():
+    point_lists = [synthetic.roc_points(200, 1)]
+    tp = np.linspace(10, 5000, 57)
+    whole = roi.sweepOptimalThresholds(point_lists, tp, -200, 0, 0, 1000, 0.01)
+    cells = roi.SWEEP_CELLS
+    try:
+        roi.SWEEP_CELLS = 1000
+        batched = roi.sweepOptimalThresholds(point_lists, tp, -200, 0, 0, 1000, 0.01)
+    finally:
+        roi.SWEEP_CELLS = cells
+    assert np.array_equal(whole['threshold'], batched['threshold'])
+    assert np.allclose(whole['roi'], batched['roi'])
+
+
+def monotone_chain(x, y):
+    # REFERENCE HULL: THE CLASSIC LOOP OVER POINTS SORTED BY x
+    def chain(direction):
+        kept = []
+        for i in range(len(x)):
+            while len(kept) >= 2:
+                a, b = kept[-2], kept[-1]
+                if direction * ((x[b] - x[a]) * (y[i] - y[a]) - (y[b] - y[a]) * (x[i] - x[a])) < 0:
+                    break
+                kept.pop()
+            kept.append(i)
+        return kept
+    return np.unique(chain(1) + chain(-1))
+
+
+def validation_sample(rows, seed):
+    rng = np.random.default_rng(seed)
+    actual = rng.uniform(size=rows) < 0.2
+    probability = np.round(np.clip(rng.normal(0.3 + 0.3 * actual, 0.2), 0, 1), 2).astype(np.float32)
+    return probability, actual
+
+
+def test_exact_curve_rates_match_each_threshold():
+    probability, actual = validation_sample(500, 0)
+    curve = roi.exactCurve(probability, actual, hull=False)
+    assert len(curve['threshold']) == len(np.unique(probability)) + 1
+    for t, tpr, fpr in zip(curve['threshold'][1:], curve['true_positive_rate'][1:], curve['false_positive_rate'][1:]):
+        chosen = probability >= t
+        assert np.isclose(tpr, (chosen & actual).sum() / actual.sum())
+        assert np.isclose(fpr, (chosen & ~actual).sum() / (~actual).sum())
+
+
+def test_hull_matches_monotone_chain_and_keeps_the_optimum():
+    probability, actual = validation_sample(3000, 1)
+    full = roi.exactCurve(probability, actual, hull=False)
+    x, y = full['false_positive_rate'], full['true_positive_rate']
+    assert np.array_equal(roi.hullVertices(x, y), monotone_chain(x, y))
+
+    hull = roi.exactCurve(probability, actual, hull=True)
+    tp = np.array([1000, 50, -10, 300])
+    fp = np.array([-200, -100, 20, -1000])
+    a = roi.sweepOptimalThresholds([full], tp, fp, 0, -20, 1000, 0.2)
+    b = roi.sweepOptimalThresholds([hull], tp, fp, 0, -20, 1000, 0.2)
+    assert np.allclose(a['roi'], b['roi'])
+
+
+def regression_residuals(seed):
+    # MODELS WITH DIFFERENT NUMBERS OF ROWS, SO THE PADDING AND THE MASK ARE EXERCISED, AND SOME ZERO ACTUALS
+    rng = np.random.default_rng(seed)
+    residuals = []
+    for rows in [250, 173, 301]:
+        actual = np.round(rng.uniform(-5, 100, size=rows)).astype(np.float32)
+        predicted = (actual * rng.normal(1, 0.15, size=rows) + rng.normal(0, 2, size=rows)).astype(np.float32)
+        residuals.append((actual, predicted))
+    return residuals
+
+
+def loop_percent_errors(actual, predicted):
+    return [100 * (float(p) - float(a)) / abs(float(a)) for a, p in zip(actual, predicted) if a != 0]
+
+
+def test_discrete_and_continuous_costs_match_loops():
+    residuals = regression_residuals(0)
+    discrete = roi.discreteErrorCost(residuals, 10, 100, 5, 200, 1000)
+    continuous = roi.continuousErrorCost(residuals, 10, 3, 1000)
+    for m, (actual, predicted) in enumerate(residuals):
+        errors = loop_percent_errors(actual, predicted)
+        cost = sum(100 for e in errors if e > 10) + sum(200 for e in errors if e < -5)
+        assert np.isclose(discrete[m], 1000 * cost / len(errors), rtol=1e-4)
+        excess = sum(max(abs(e) - 10, 0) for e in errors)
+        assert np.isclose(continuous[m], 1000 * 3 * excess / len(errors), rtol=1e-4)
+
+
+def test_aggregate_cost_matches_loop_over_groups():
+    residuals = regression_residuals(1)
+    costs = roi.aggregateErrorCost(residuals, 40, 10, 1000, 52)
+    for m, (actual, predicted) in enumerate(residuals):
+        group_costs = []
+        for start in range(0, len(actual), 40):
+            total = float(np.sum(actual[start:start + 40], dtype=np.float64))
+            if total != 0:
+                error = 100 * abs(float(np.sum(predicted[start:start + 40], dtype=np.float64)) - total) / abs(total)
+                group_costs.append(1000 * error / 10)
+        assert np.isclose(costs[m], 52 * sum(group_costs) / len(group_costs), rtol=1e-4)
+
+
+def test_roi_at_capacity_matches_a_search_over_points_within_capacity():
+    gains = roi.gainsArrays(synthetic.roc_points(60, 3), 1000, 0.1)
+    rois = roi.volumeRoi(gains, 500, -60, 0, 0, 1000, 0.1)
+    capacities = [0, 5, 40, 100, 250, 2000]
+    best = roi.roiAtCapacity(gains, rois, capacities)
+    for c, capacity in enumerate(capacities):
+        within = [(rois[i], gains['volume'][i]) for i in range(len(rois)) if gains['volume'][i] <= capacity]
+        limited = min(capacity, gains['volume'][-1])
+        within.append((np.interp(limited, gains['volume'], rois), limited))
+        assert np.isclose(best['roi'][c], max(r for r, v in within))
+        assert best['contacts'][c] <= capacity
+        assert np.isclose(np.interp(best['contacts'][c], gains['volume'], rois), best['roi'][c])
+
+
+def test_capacity_for_roi_is_the_fewest_contacts_reaching_the_target():
+    gains = roi.gainsArrays(synthetic.roc_points(60, 4), 1000, 0.1)
+    rois = roi.volumeRoi(gains, 500, -60, 0, 0, 1000, 0.1)
+    targets = [rois.min(), 0.5 * rois.max(), rois.max(), rois.max() + 1]
+    needed = roi.capacityForRoi(gains, rois, targets)
+    grid = np.linspace(0, gains['volume'][-1], 200001)
+    curve = np.interp(grid, gains['volume'], rois)
+    for target, contacts in zip(targets[0:3], needed[0:3]):
+        assert np.interp(contacts, gains['volume'], rois) >= target - 1e-6 * abs(target)
+        assert (curve[grid < contacts - grid[1]] < target).all()
+    assert np.isnan(needed[3])
+
+
+def test_fetch_concurrently_applies_one_deadline_to_the_batch():
+    release = threading.Event()
+
+    def fetch(mod):
+        if mod % 2 == 1:
+            release.wait(10)
+        return mod * 10
+    start = time.time()
+    try:
+        results = roi.fetchConcurrently(fetch, list(range(8)), 4, 0.5)
+    finally:
+        release.set()
+    # FOUR HUNG FETCHES (AND ANY QUEUED BEHIND THEM) SHARE THE ONE 0.5 SECOND WAIT
+    assert time.time() - start < 1.5
+    assert results == [0, None, 20, None, 40, None, 60, None]
+
+
+def test_parse_and_draw_distributions():
+    assert roi.parseDistribution(" 100 ") == ('fixed', 100.0, 0.0)
+    assert roi.parseDistribution("50:150") == ('uniform', 50.0, 150.0)
+    assert roi.parseDistribution("100~20") == ('normal', 100.0, 20.0)
+    assert roi.centralValue("50:150") == 100.0
+    rng = np.random.default_rng(0)
+    uniform = roi.drawDistribution("50:150", rng, 20000)
+    assert uniform.min() >= 50 and uniform.max() <= 150 and abs(uniform.mean() - 100) < 1
+    normal = roi.drawDistribution("100~20", rng, 20000)
+    assert abs(normal.mean() - 100) < 1 and abs(normal.std() - 20) < 1
+    assert (roi.drawDistribution(7, rng, 5) == 7).all()
+
+
+def test_simulated_scenarios_summaries(monkeypatch):
+    point_lists = [synthetic.roc_points(n, seed) for seed, n in enumerate([40, 60, 80])]
+    monkeypatch.setattr(roi, 'fetchCurves', lambda models, max_workers, timeout, exact: point_lists)
+    models = ['a', 'b', 'c']
+    summaries = roi.simulateBinaryClassModels(models, 3, 4000, 0, "500:1500", "-200~50", 0, 0, 1000, 0.05)
+    assert sorted(summaries) == [0, 1, 2]
+    assert abs(sum(s['p_best'] for s in summaries.values()) - 1) <= 0.002
+    for s in summaries.values():
+        assert s['roi_p05'] <= s['roi_p50'] <= s['roi_p95']
+        assert s['threshold_p05'] <= s['threshold_p95']
+        assert 0 < s['threshold_mode_share'] <= 1
+
+    # FIXED INPUTS GIVE THE SAME ROI AS THE SWEEP FOR EVERY DRAW, AND ONE THRESHOLD
+    fixed = roi.simulateBinaryClassModels(models, 3, 50, 0, 1000, -200, 0, 0, 1000, 0.05)
+    sweep = roi.sweepOptimalThresholds(point_lists, 1000, -200, 0, 0, 1000, 0.05)
+    for m in range(3):
+        assert fixed[m]['roi_p05'] == fixed[m]['roi_p95'] == round(float(sweep['roi'][m, 0]), 0)
+        assert fixed[m]['threshold_mode_share'] == 1.0
+
+
+def test_simulated_intervention_does_not_log_the_draws(monkeypatch, caplog):
+    monkeypatch.setattr(roi, 'fetchCurves', lambda models, max_workers, timeout, exact: [synthetic.roc_points(40, 0)])
+    with caplog.at_level('INFO', logger=roi.log.name):
+        roi.simulateInterventionModels(['a'], 1, 1000, 0, 1000, 0.05, 10, "100:300", 0, 0.5, 0.1)
+    assert not any('Payoff' in record.getMessage() for record in caplog.records)
+    with caplog.at_level('INFO', logger=roi.log.name):
+        roi.convertIntervention(1000, 0.05, 10, 200, 0, 0.5, 0.1)
+    assert any('Payoff' in record.getMessage() for record in caplog.records)
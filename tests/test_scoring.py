@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+import cache
+import scoring
+import synthetic
+
+
+class CountingScorer(scoring.FakeScorer):
+
+    def __init__(self, columns=None):
+        scoring.FakeScorer.__init__(self, columns)
+        self.rows = []
+
+    def score(self, pdata):
+        self.rows.append(len(pdata))
+        return scoring.FakeScorer.score(self, pdata)
+
+
+def same_predictions(a, b):
+    assert list(a['row_id']) == list(b['row_id'])
+    assert list(a['prediction']) == list(b['prediction'])
+    assert np.array_equal(a['positive_probability'].values, b['positive_probability'].values)
+
+
+def test_cached_scorer_sends_only_unique_misses_and_matches_the_scorer():
+    data = synthetic.tabular(300, [4, 5], seed=2)[['x0', 'x1']]
+    data = pd.concat([data, data.iloc[0:120]], ignore_index=True).sample(frac=1, random_state=0)
+    unique = len(data.drop_duplicates())
+    inner = CountingScorer()
+    scorer = scoring.CachedScorer(inner, cache.PredictionCache(':memory:', 100000))
+
+    first = scorer.score(data)
+    assert inner.rows == [unique]
+    same_predictions(first, scoring.FakeScorer().score(data))
+
+    second = scorer.score(data)
+    assert inner.rows == [unique]
+    same_predictions(second, first)
+
+    # A FRAME OF CACHED AND NEW ROWS SENDS ONLY THE NEW ONES
+    more = pd.concat([data.iloc[0:50], pd.DataFrame({'x0': [-1, -2], 'x1': [-1, -1]})], ignore_index=True)
+    mixed = scorer.score(more)
+    assert inner.rows == [unique, 2]
+    same_predictions(mixed, scoring.FakeScorer().score(more))